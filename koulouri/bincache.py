@@ -0,0 +1,222 @@
+"""
+Compact binary `songcache` format.
+
+The file is made up of a header, a table of fixed-width track records, a table mapping album-sorted
+positions to records and a pool of interned strings. It is opened with `mmap`, and a record is only
+decoded when something accesses it, so opening even a very large library costs about the same as a
+small one.
+"""
+import json
+import mmap
+import os
+import time
+import struct
+import weakref
+from collections.abc import Sequence
+from metadata import parse_track
+
+MAGIC = b"KOUL"
+VERSION = 1
+
+# magic, version, record count, record size, offset of the album order table, offset of the string pool
+HEADER = struct.Struct("<4sHxxIIQQ")
+# sha256 tid, path, type, artist, album_artist, album, title, genre (string pool offsets), track, duration,
+# mtime, size, inode
+RECORD = struct.Struct("<32s7Iidqqq")
+INDEX = struct.Struct("<I")
+LENGTH = struct.Struct("<I")
+
+NONE = 0xFFFFFFFF # string offset used for missing values
+NO_STAT = -1
+STRINGS = ["path", "type", "artist", "album_artist", "album", "title", "genre"]
+
+_open = weakref.WeakSet() # every open `BinaryCache`, see `_release`
+
+class CacheFormatError(ValueError):
+    """
+    Raised when a cache file isn't in a format (or version) we understand.
+    """
+    pass
+
+def _release(path: str):
+    """
+    Copy any cache of `path` this process has open into memory, so the file can be replaced. Windows
+    won't replace a file while it is mapped.
+    """
+    for cache in list(_open):
+        if os.path.abspath(cache.path) == os.path.abspath(path):
+            cache._detach()
+
+def _album_key(entry: dict) -> tuple:
+    album = entry["info"]["album"]
+    return (album is None, album or "")
+
+def write_cache(path: str, entries: list):
+    """
+    Write `entries` into a binary cache at `path`.
+
+    The file is written next to the destination first and renamed into place, so readers never see a
+    partially written cache.
+    """
+    pool = bytearray()
+    interned = {}
+
+    def intern(value) -> int:
+        if value is None:
+            return NONE
+        value = str(value)
+        if value not in interned:
+            interned[value] = len(pool)
+            encoded = value.encode("utf-8", "surrogateescape")
+            pool.extend(LENGTH.pack(len(encoded)))
+            pool.extend(encoded)
+        return interned[value]
+
+    table = bytearray()
+    for entry in entries:
+        info = entry["info"]
+        stat = entry.get("stat") or {}
+        table.extend(RECORD.pack(
+            bytes.fromhex(entry["id"]),
+            *[intern(info[_]) for _ in STRINGS],
+            parse_track(info["track"]),
+            info["duration"] or 0.0,
+            stat.get("mtime", NO_STAT),
+            stat.get("size", NO_STAT),
+            stat.get("inode", NO_STAT),
+        ))
+
+    # the same (stable) order `sorted(songs, key=album)` would produce, with untagged albums last
+    order = sorted(range(len(entries)), key=lambda i: _album_key(entries[i]))
+    album_order = b"".join(INDEX.pack(_) for _ in order)
+
+    order_offset = HEADER.size + len(table)
+    pool_offset = order_offset + len(album_order)
+    header = HEADER.pack(MAGIC, VERSION, len(entries), RECORD.size, order_offset, pool_offset)
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(table)
+        f.write(album_order)
+        f.write(pool)
+
+    _release(path)
+    for attempt in range(10):
+        try:
+            os.replace(tmp, path)
+            break
+        except PermissionError: # mapped by another process (windows), which should let go soon
+            if attempt == 9:
+                raise
+            time.sleep(0.1)
+
+class BinaryCache(Sequence):
+    """
+    A read-only, lazily decoded view of a binary cache.
+
+    Behaves like the list of `{"id": ..., "info": {...}, "stat": {...}}` dicts stored in `songcache.json`.
+    An empty file is an empty cache.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0: # mmap can't map nothing
+                self.__map = b""
+                self.__count = 0
+                return
+            self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.__map) < HEADER.size:
+            self.close()
+            raise CacheFormatError("cache is too small")
+        magic, version, count, record_size, order_offset, pool_offset = HEADER.unpack_from(self.__map, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            self.close()
+            raise CacheFormatError(f"unsupported cache (magic {magic!r}, version {version})")
+
+        self.__count = count
+        self.__order_offset = order_offset
+        self.__pool_offset = pool_offset
+        self.__strings = {}
+        _open.add(self)
+
+    def _detach(self):
+        """
+        Swap the mapping for a copy in memory, letting go of the file.
+        """
+        if isinstance(self.__map, mmap.mmap) and not self.__map.closed:
+            mapping, self.__map = self.__map, self.__map[:]
+            mapping.close()
+
+    def __len__(self) -> int:
+        return self.__count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[_] for _ in range(*index.indices(self.__count))]
+        if index < 0:
+            index += self.__count
+        if not 0 <= index < self.__count:
+            raise IndexError("cache index out of range")
+        return self._decode(index)
+
+    def _string(self, offset: int) -> str | None:
+        if offset == NONE:
+            return None
+        if offset not in self.__strings:
+            start = self.__pool_offset + offset
+            length = LENGTH.unpack_from(self.__map, start)[0]
+            raw = self.__map[start+LENGTH.size:start+LENGTH.size+length]
+            self.__strings[offset] = raw.decode("utf-8", "surrogateescape")
+        return self.__strings[offset]
+
+    def _decode(self, index: int) -> dict:
+        tid, *fields = RECORD.unpack_from(self.__map, HEADER.size + index * RECORD.size)
+        strings, (track, duration, mtime, size, inode) = fields[:len(STRINGS)], fields[len(STRINGS):]
+
+        info = {_: self._string(offset) for _, offset in zip(STRINGS, strings)}
+        info = {"path": info["path"], "type": info["type"], "duration": duration, "artist": info["artist"],
+                "album_artist": info["album_artist"], "album": info["album"], "title": info["title"],
+                "genre": info["genre"], "track": track}
+
+        entry = {"id": tid.hex(), "info": info}
+        if mtime != NO_STAT:
+            entry["stat"] = {"mtime": mtime, "size": size, "inode": inode}
+        return entry
+
+    def by_album(self, index: int) -> dict:
+        """
+        Fetch the track at `index` when sorted by album, without decoding the rest of the cache.
+        """
+        if index < 0:
+            index += self.__count
+        if not 0 <= index < self.__count:
+            raise IndexError("cache index out of range")
+        return self._decode(INDEX.unpack_from(self.__map, self.__order_offset + index * INDEX.size)[0])
+
+    def sorted_by_album(self):
+        """
+        Lazily iterate over every track, sorted by album.
+        """
+        for i in range(self.__count):
+            yield self.by_album(i)
+
+    def close(self):
+        if isinstance(self.__map, mmap.mmap):
+            self.__map.close()
+        _open.discard(self)
+
+def export_json(entries, path: str):
+    """
+    Export a cache (or any list of tracks) as a `songcache.json` compatible file.
+    """
+    with open(path, "w") as f:
+        json.dump(list(entries), f)
+
+def import_json(path: str) -> list:
+    """
+    Load the tracks from a `songcache.json` compatible file.
+    """
+    with open(path, "r") as f:
+        return json.load(f)
@@ -0,0 +1,164 @@
+"""
+User data (favorites) stored in `kdata.json`.
+
+Everything is kept in memory, changes are written out in the background a moment after they were made
+(see `WriteBehind`), so toggling a bunch of favorites in a row only rewrites the file once.
+"""
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+
+DATA_PATH = "kdata.json"
+SAVE_DELAY = 1.0 # seconds to wait for more changes before writing
+
+class WriteBehind:
+    """
+    Saves a JSON snapshot of something to `path` in the background, `delay` seconds after it `changed`.
+
+    `snapshot` is called from the writer thread, so it should take whatever lock guards the data. The
+    file is written as a whole to a temp file that then replaces the old one, so it is never left half
+    written. Pending changes are flushed when the program exits, or with `flush`.
+    """
+    def __init__(self, path: str, snapshot, delay: float = SAVE_DELAY):
+        self.path = path
+        self.__snapshot = snapshot
+        self.__delay = delay
+        self.__lock = threading.Lock() # one write at a time
+        self.__dirty = False
+        self.__wake = threading.Event()
+        self.__writer = None
+
+        atexit.register(self.flush)
+
+    def changed(self):
+        """
+        Schedule a write.
+        """
+        self.__dirty = True
+        if self.__writer is None:
+            self.__writer = threading.Thread(target=self.__write_behind, name="koulouri-save", daemon=True)
+            self.__writer.start()
+        self.__wake.set()
+
+    def __write_behind(self):
+        while True:
+            self.__wake.wait()
+            time.sleep(self.__delay) # let more changes pile up
+            self.__wake.clear()
+            self.flush()
+
+    def flush(self):
+        """
+        Write any pending changes to disk now.
+        """
+        with self.__lock:
+            if not self.__dirty:
+                return
+            self.__dirty = False
+            snapshot = self.__snapshot()
+
+            try:
+                with open(f"{self.path}.tmp", "w") as f:
+                    json.dump(snapshot, f)
+                os.replace(f"{self.path}.tmp", self.path)
+            except OSError as e:
+                logging.warning(f"unable to save '{self.path}': {e}")
+                self.__dirty = True # try again with the next change
+
+class Data:
+    """
+    The user's favorites, plus anything else found in the data file (which is kept as is).
+    """
+    def __init__(self, path: str = DATA_PATH, delay: float = SAVE_DELAY):
+        self.__path = path
+        self.__data = {}
+        self.__favorites = {} # tid -> None, a set that also remembers the order favorites were added in
+        self.version = 0 # increases whenever the favorites change
+
+        self.__lock = threading.Lock() # guards the data against the writer
+        self.__saver = WriteBehind(path, self._snapshot, delay)
+
+        self.__load()
+
+    def __load(self):
+        """
+        Load disk to memory.
+        """
+        try:
+            with open(self.__path, "r") as f:
+                self.__data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.warning(f"unable to read '{self.__path}': {e}")
+            return
+        self.__favorites = dict.fromkeys(self.__data.get("favorites", []))
+
+    def __changed(self):
+        self.version += 1
+        self.__saver.changed()
+
+    def _snapshot(self) -> dict:
+        with self.__lock:
+            return dict(self.__data, favorites=list(self.__favorites))
+
+    def flush(self):
+        """
+        Write any pending changes to disk now.
+        """
+        self.__saver.flush()
+
+    def add_favorite(self, tid: str):
+        """
+        Add a track to the user's favorites.
+
+        Returns False if the song is already a favorite.
+        """
+        with self.__lock:
+            if tid in self.__favorites:
+                return False
+            self.__favorites[tid] = None
+            self.__changed()
+        return True
+
+    def remove_favorite(self, tid: str):
+        """
+        Remove a track from the user's favorites.
+
+        Returns False if the track did not exist already.
+        """
+        with self.__lock:
+            if tid not in self.__favorites:
+                return False
+            del self.__favorites[tid]
+            self.__changed()
+        return True
+
+    def toggle_favorite(self, tid: str):
+        """
+        Helper function that automatically adds or removes a track to the user's
+        favorite.
+
+        Returns the current status of `is_favorite` after toggling.
+        """
+        if not self.add_favorite(tid):
+            self.remove_favorite(tid)
+
+        return self.is_favorite(tid)
+
+    @property
+    def favorites(self) -> list:
+        """
+        The TIDs of every favorite track.
+        """
+        with self.__lock:
+            return list(self.__favorites)
+
+    def is_favorite(self, tid: str):
+        """
+        Fetch a favorite song by its TID, if it exists.
+        """
+        return tid in self.__favorites
@@ -0,0 +1,159 @@
+"""
+PCM sources read by the `player_pyaudio.Player` producer thread.
+
+Every source exposes the same small interface: `rate`, `channels`, `sample_format`, `sample_width`,
+`read(frames)`, `seek(seconds)`, `succeeded()` and `close()`. Sample formats are named after FFmpeg's (see `dsp.WIDTHS`).
+"""
+import mmap
+import struct
+import subprocess
+import pydub, pydub.utils
+import metadata
+from dsp import WIDTHS
+
+def probe_format(path: str, type: str) -> tuple[int, int, int]:
+    """
+    Fetch a file's native (sample rate, channels, bits per sample), reading the headers when possible.
+    """
+    try:
+        header = metadata.read_header(path, type)
+        if header.sample_rate:
+            return header.sample_rate, header.channels, header.bits
+    except (metadata.MetadataError, OSError):
+        pass
+
+    info = pydub.utils.mediainfo(path)
+    return (int(info.get("sample_rate", 44100)), int(info.get("channels", 2)),
+            int(info.get("bits_per_raw_sample") or info.get("bits_per_sample") or 16))
+
+class BufferSource:
+    """
+    Reads from PCM that has already been fully decoded, held in memory or memory-mapped from a WAV file
+    (see `from_wav`).
+
+    Chunks are returned as `memoryview` slices of the buffer, so reading and seeking never copy anything.
+    """
+    def __init__(self, data, rate: int, channels: int = 2, sample_format: str = "s16", mapping: mmap.mmap | None = None):
+        self.rate = rate
+        self.channels = channels
+        self.sample_format = sample_format
+        self.sample_width = WIDTHS[sample_format]
+        self.__frame_bytes = channels * self.sample_width
+        self.__data = memoryview(data).cast("B")
+        self.__mapping = mapping
+        self.__pos = 0
+
+    @classmethod
+    def from_wav(cls, path: str, sample_format: str = "s16"):
+        """
+        Memory-map the audio of a (PCM) WAV file.
+
+        WAV headers written by `wave` can't tell 32-bit ints and floats apart, so the format has to be known.
+        """
+        with open(path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if mapping[:4] != b"RIFF" or mapping[8:12] != b"WAVE":
+                raise ValueError(f"'{path}' is not a WAV file")
+
+            fmt = None
+            pos = 12
+            while pos + 8 <= len(mapping):
+                chunk, size = struct.unpack_from("<4sI", mapping, pos)
+                pos += 8
+                if chunk == b"fmt ":
+                    fmt = struct.unpack_from("<HHIIHH", mapping, pos)
+                elif chunk == b"data" and fmt:
+                    _, channels, rate, _, _, bits = fmt
+                    if bits // 8 != WIDTHS[sample_format]:
+                        raise ValueError(f"'{path}' isn't {sample_format}")
+                    data = memoryview(mapping)[pos:pos+size]
+                    return cls(data, rate, channels, sample_format, mapping)
+                pos += size + (size & 1) # chunks are padded to an even size
+            raise ValueError(f"'{path}' has no audio")
+        except:
+            mapping.close()
+            raise
+
+    def read(self, frames: int) -> memoryview:
+        chunk = self.__data[self.__pos:self.__pos + frames * self.__frame_bytes]
+        self.__pos += len(chunk)
+        return chunk
+
+    def seek(self, seconds: float) -> bool:
+        """
+        Move to `seconds` into the audio. Returns False if that position doesn't exist.
+        """
+        pos = int(seconds * self.rate) * self.__frame_bytes
+        if pos < 0 or pos > len(self.__data):
+            return False
+        self.__pos = pos
+        return True
+
+    def succeeded(self) -> bool:
+        """
+        Whether the audio was decoded without errors. Always the case, since it was decoded up front.
+        """
+        return True
+
+    def close(self):
+        self.__data.release()
+        if self.__mapping:
+            try:
+                self.__mapping.close()
+            except BufferError: # a chunk is still in use, the mapping is closed once it's gone
+                pass
+            self.__mapping = None
+
+class FFmpegSource:
+    """
+    Streams PCM from an ffmpeg pipe as it is decoded, instead of converting the whole file first.
+
+    Output is converted to `channels`, `rate` and `sample_format`. Seeking restarts the decoder at the
+    new offset.
+    """
+    def __init__(self, path: str, rate: int, channels: int = 2, duration: float | None = None, start: float = 0,
+                 sample_format: str = "s16"):
+        self.path = path
+        self.rate = rate
+        self.channels = channels
+        self.sample_format = sample_format
+        self.sample_width = WIDTHS[sample_format]
+        self.duration = duration
+        self.__proc = None
+
+        self._spawn(start)
+
+    def _spawn(self, start: float):
+        self.close()
+        command = [
+            pydub.AudioSegment.converter, "-nostdin", "-loglevel", "error",
+            "-ss", f"{start:.3f}", "-i", self.path,
+            "-vn", "-f", f"{self.sample_format}le", "-acodec", f"pcm_{self.sample_format}le", "-ac", str(self.channels), "-ar", str(self.rate),
+            "-",
+        ]
+        self.__proc = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                       stderr=subprocess.DEVNULL)
+
+    def read(self, frames: int) -> bytes:
+        # blocks until the whole chunk is available, or ffmpeg has finished
+        return self.__proc.stdout.read(frames * self.channels * self.sample_width)
+
+    def seek(self, seconds: float) -> bool:
+        if seconds < 0 or (self.duration is not None and seconds > self.duration):
+            return False
+        self._spawn(seconds)
+        return True
+
+    def succeeded(self) -> bool:
+        """
+        Whether ffmpeg finished decoding without errors. Only meaningful once `read` has run dry.
+        """
+        return self.__proc is not None and self.__proc.wait() == 0
+
+    def close(self):
+        if self.__proc:
+            self.__proc.kill()
+            self.__proc.stdout.close()
+            self.__proc.wait()
+            self.__proc = None
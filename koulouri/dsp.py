@@ -0,0 +1,66 @@
+"""
+Audio processing applied before audio reaches the output stream.
+
+Uses NumPy when it is installed, falling back to the standard library's `audioop` (and finally
+`array`) otherwise.
+"""
+from array import array
+
+try:
+    import numpy
+except ModuleNotFoundError: # optional, but much faster
+    numpy = None
+
+try:
+    import audioop # removed in Python 3.13
+except ModuleNotFoundError:
+    audioop = None
+
+DTYPES = {"s16": "<i2", "s32": "<i4", "f32": "<f4"} # numpy
+TYPECODES = {"s16": "h", "s32": "i", "f32": "f"} # array
+WIDTHS = {"s16": 2, "s32": 4, "f32": 4}
+
+class Gain:
+    """
+    Volume stage for little-endian PCM, either signed 16-bit (`s16`), signed 32-bit (`s32`, which 24-bit
+    audio is padded to) or 32-bit float (`f32`).
+
+    Each chunk is scaled all at once into a buffer that is reused between chunks, so the returned
+    data is only valid until the next call to `apply`.
+    """
+    def __init__(self):
+        self.__out = None # preallocated output samples
+        self.__silence = b""
+
+    def _output(self, samples: int, dtype: str):
+        if self.__out is None or len(self.__out) < samples or self.__out.dtype != numpy.dtype(dtype):
+            self.__out = numpy.empty(samples, dtype=dtype)
+        return self.__out[:samples]
+
+    def apply(self, data, volume: int, sample_format: str = "s16"):
+        """
+        Scale a chunk of audio by `volume` (0-100).
+        """
+        if volume >= 100: # nothing to do
+            return data
+        if volume <= 0: # zeroes are silent in every format
+            if len(self.__silence) != len(data):
+                self.__silence = bytes(len(data))
+            return self.__silence
+
+        factor = volume / 100
+
+        if numpy is not None:
+            samples = numpy.frombuffer(data, dtype=DTYPES[sample_format])
+            out = self._output(len(samples), DTYPES[sample_format])
+            # a factor below 1 can't clip, and the cast truncates just like int() did
+            numpy.multiply(samples, factor, out=out, casting="unsafe")
+            return out.data.cast("B")
+
+        if audioop is not None and sample_format != "f32":
+            return audioop.mul(bytes(data), WIDTHS[sample_format], factor)
+
+        samples = array(TYPECODES[sample_format], bytes(data))
+        if sample_format == "f32":
+            return array("f", (_ * factor for _ in samples)).tobytes()
+        return array(TYPECODES[sample_format], (int(_ * factor) for _ in samples)).tobytes()
@@ -0,0 +1,227 @@
+"""
+Out-of-process audio engine.
+
+Runs `player_pyaudio.Player` in its own process, so decoding and feeding the output device never have to
+wait on the UI (or a library scan) for the GIL.
+"""
+import struct
+import threading
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+import lyrics
+
+# seq, position, remaining, buffered, transitions, volume, playing, stream active, producer active
+STATUS = struct.Struct("<Qdddii???")
+PUBLISH_INTERVAL = 0.02 # how often the engine refreshes the status block while playing
+
+def _publish(status: memoryview, player):
+    """
+    Write the player's state into the status block, returning the values that were written.
+
+    The sequence number is odd while writing, so readers know to try again (see `RemotePlayer._status`).
+    """
+    playing, stream_active = player.is_playing()
+    values = (player.get_time(), player.get_remaining(), player.get_buffered(), player.transitions,
+              player.volume, playing, stream_active, player.is_active())
+
+    seq = struct.unpack_from("<Q", status, 0)[0]
+    struct.pack_into("<Q", status, 0, seq + 1)
+    STATUS.pack_into(status, 0, seq + 1, *values)
+    struct.pack_into("<Q", status, 0, seq + 2)
+    return values
+
+def _serve(conn, name: str, options: dict):
+    """
+    Engine process entry point. Runs commands received over `conn` until told to exit.
+    """
+    from player_pyaudio import Player # only the engine process touches the audio device
+
+    block = shared_memory.SharedMemory(name=name)
+    player = Player(**options)
+    lock = threading.Lock() # commands and the publisher both read the player
+    done = threading.Event()
+    wake = threading.Event() # set after every command, since it may have started playback
+
+    def publisher():
+        while not done.is_set():
+            wake.clear()
+            with lock:
+                busy = _publish(block.buf, player)[-1] # what the frontends see, not what it is a moment later
+            wake.wait(PUBLISH_INTERVAL if busy else None)
+
+    thread = threading.Thread(target=publisher, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            try:
+                method, args = conn.recv()
+            except EOFError: # the frontend went away
+                break
+
+            with lock:
+                try:
+                    if method == "exit":
+                        player.exit()
+                        conn.send((True, None))
+                        break
+                    elif method == "volume":
+                        player.volume = args[0]
+                        result = player.volume
+                    elif method == "current":
+                        result = player.current
+                    else:
+                        result = getattr(player, method)(*args)
+                    _publish(block.buf, player) # so the frontend never sees the state from before the command
+                    wake.set()
+                    conn.send((True, result))
+                except Exception as e:
+                    logging.exception(f"engine command '{method}' failed")
+                    conn.send((False, e))
+    finally:
+        done.set()
+        wake.set()
+        thread.join()
+        block.close()
+
+class RemotePlayer:
+    """
+    Stand-in for `player_pyaudio.Player` that runs the real one in a separate process.
+
+    Commands (play, pause, seek, volume...) are sent over a pipe and wait for the engine to answer. The
+    values the frontends poll constantly (time, status, volume) are instead read from a small shared memory
+    block that the engine keeps up to date, so polling never blocks on the engine.
+
+    `options` are passed on to the engine's `Player`. Discord RPC stays in this process, and is updated
+    whenever the engine moves on to another track.
+    """
+    def __init__(self, rpc = None, **options):
+        self.__rpc = rpc
+        self.__lock = threading.Lock() # one command at a time
+        self.__block = shared_memory.SharedMemory(create=True, size=STATUS.size)
+        self.__block.buf[:STATUS.size] = bytes(STATUS.size)
+        self.__current = None
+        self.__transitions = 0
+
+        context = multiprocessing.get_context("spawn") # don't inherit the frontend's threads
+        self.__conn, child = context.Pipe()
+        self.__process = context.Process(target=_serve, args=(child, self.__block.name, options),
+                                         name="koulouri-engine", daemon=True)
+        self.__process.start()
+        child.close()
+        self._call("current") # wait for the engine to be up and to have published its state
+
+    def _call(self, method: str, *args):
+        with self.__lock:
+            if not self.__process.is_alive():
+                raise RuntimeError("the audio engine has exited")
+            self.__conn.send((method, args))
+            try:
+                ok, result = self.__conn.recv()
+            except EOFError:
+                raise RuntimeError("the audio engine has exited")
+        if not ok:
+            raise result
+        return result
+
+    def _status(self) -> tuple:
+        """
+        Read a consistent copy of the status block.
+        """
+        buf = self.__block.buf
+        while True:
+            values = STATUS.unpack_from(buf, 0)
+            if not values[0] & 1 and struct.unpack_from("<Q", buf, 0)[0] == values[0]:
+                return values[1:]
+
+    def _now_playing(self, info: dict | None):
+        self.__current = info
+        if self.__rpc and info: # update RPC stats
+            if not self.__rpc.is_alive():
+                self.__rpc.start()
+
+            self.__rpc.title = info["title"]
+            self.__rpc.artist = info["artist"]
+            self.__rpc.album = info["album"]
+
+    @property
+    def volume(self) -> int:
+        """
+        An int between 0 and 100.
+        """
+        return self._status()[4]
+
+    @volume.setter
+    def volume(self, new_vol: int):
+        self._call("volume", new_vol)
+
+    @property
+    def transitions(self) -> int:
+        transitions = self._status()[3]
+        if transitions != self.__transitions: # the engine moved on to the hinted track
+            self.__transitions = transitions
+            self._now_playing(self._call("current"))
+        return transitions
+
+    @property
+    def current(self) -> dict | None:
+        self.transitions # catch up first
+        return self.__current
+
+    def play(self, path: str, input_format: str, tid: str | None = None):
+        info = self._call("play", path, input_format, tid)
+        self.__transitions = self._status()[3]
+        self._now_playing(info)
+        return info
+
+    def queue_next(self, path: str | None, input_format: str | None = None, tid: str | None = None):
+        self._call("queue_next", path, input_format, tid)
+
+    def stop(self):
+        self._call("stop")
+
+    def pause(self):
+        self._call("pause")
+
+    def resume(self):
+        self._call("resume")
+
+    def seek(self, to: int):
+        self._call("seek", to)
+
+    def get_time(self) -> float:
+        return self._status()[0]
+
+    def get_remaining(self) -> float:
+        return self._status()[1]
+
+    def get_buffered(self) -> float:
+        return self._status()[2]
+
+    def get_info(self, path: str, type: str):
+        return self._call("get_info", path, type)
+
+    def fetch_lyrics(self, path: str) -> lyrics.Lyrics:
+        return lyrics.load(path) # only reads the .lrc file, no need to involve the engine
+
+    def is_playing(self) -> tuple[bool, bool]:
+        return self._status()[5:7]
+
+    def is_active(self) -> bool:
+        return self._status()[7]
+
+    def exit(self):
+        """
+        Shut the engine down and release the shared memory.
+        """
+        try:
+            self._call("exit")
+        except (RuntimeError, OSError): # already gone
+            pass
+        self.__process.join(5)
+        if self.__process.is_alive():
+            self.__process.kill()
+        self.__conn.close()
+        self.__block.close()
+        self.__block.unlink()
@@ -2,13 +2,13 @@ import sys
 import threading
 import time
 import logging as log
-import random
 log.basicConfig(level=log.DEBUG,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
 from PyQt5 import QtCore, QtWidgets
 from player_pyaudio import Player
 from main import fetch_cache, VERSION
+from playqueue import PlayQueue
 
 
 class PlayerWorker(QtCore.QObject):
@@ -52,8 +52,34 @@ class PlayerWorker(QtCore.QObject):
         self.finished.emit()
 
 
+class QueueModel(QtCore.QAbstractListModel):
+    """
+    Exposes the play queue to a list view, which only asks for the rows it is showing.
+    """
+    def __init__(self, queue: PlayQueue, parent=None):
+        super().__init__(parent)
+        self.queue = queue
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.queue)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole or not 0 <= index.row() < len(self.queue):
+            return None
+        return self.queue[index.row()]["info"]["title"]
+
+    def refresh(self):
+        """
+        Redraw every row, after the queue changed.
+        """
+        self.beginResetModel()
+        self.endResetModel()
+
+
 class Widget(QtWidgets.QWidget):
-    def __init__(self, parent=None):
+    libraryChanged = QtCore.pyqtSignal(list, list)
+
+    def __init__(self, parent=None, watcher=None, player=None):
         super().__init__(parent)
 
         self.setWindowTitle(f"koulouri v{VERSION} - EARLY GUI")
@@ -61,33 +87,26 @@ class Widget(QtWidgets.QWidget):
         self.__length = 0
         self.__paused = False
         self.__alive = False
-        self.__queue = []
-        self.__song_list = [] # widgets
-        self.__index = -1
         self.__current_song = None
 
-        self.player = Player()
+        self.player = player or Player()
 
-        # set up queue
+        # set up queue, picking up the last session if there is one
         song_meta = fetch_cache()
         self.songs = sorted(song_meta, key=lambda d: d["info"]["album"])
-        random.shuffle(self.songs)
-        self.__queue = self.songs
+        self.__queue = PlayQueue.load({_["id"]: _ for _ in self.songs})
+        if not self.__queue:
+            self.__queue.extend(self.songs)
+            self.__queue.shuffle()
 
 
         # QT Widgets
 
-        songlistcont = QtWidgets.QGroupBox()
-        songlistform = QtWidgets.QFormLayout()
-        labellist = []
-        for i, song in enumerate(self.songs):
-            labellist.append(QtWidgets.QLabel(song["info"]["title"]))
-            songlistform.addRow(labellist[i])
-        songlistcont.setLayout(songlistform)
-        scroll = QtWidgets.QScrollArea()
-        scroll.setWidget(songlistcont)
-        scroll.setWidgetResizable(True)
-        # scroll.setFixedHeight(200)
+        self.__song_model = QueueModel(self.__queue)
+        songlist = QtWidgets.QListView()
+        songlist.setModel(self.__song_model)
+        songlist.setUniformItemSizes(True) # so it doesn't measure every row, only the visible ones are drawn
+        # songlist.setFixedHeight(200)
 
 
         self.volume = QtWidgets.QSlider()
@@ -103,7 +122,7 @@ class Widget(QtWidgets.QWidget):
 
 
         lay = QtWidgets.QGridLayout(self)        
-        lay.addWidget(scroll)
+        lay.addWidget(songlist)
         lay.addWidget(self.label)
         lay.addWidget(self.play_button)
         lay.addWidget(self.pause_button)
@@ -118,6 +137,30 @@ class Widget(QtWidgets.QWidget):
         self.previous_button.clicked.connect(self.previous)
         self.volume.valueChanged.connect(self.volchange)
 
+        # the watcher calls us from its own thread, so changes are passed through a signal
+        self.watcher = watcher
+        self.libraryChanged.connect(self.apply_library_changes)
+        if self.watcher:
+            self.watcher.add_listener(self.libraryChanged.emit)
+
+    def apply_library_changes(self, updated: list, removed: list):
+        """
+        Apply changes from the library watcher to the queue and song list.
+        """
+        gone = set(removed)
+        changed = {_["info"]["path"]: _ for _ in updated}
+
+        affected = [(i, _["info"]["path"]) for i, _ in enumerate(self.__queue)
+                    if _["info"]["path"] in gone or _["info"]["path"] in changed]
+        for i, path in reversed(affected):
+            if path in gone:
+                self.__queue.pop(i) # the queue keeps playing from the same place
+            elif path in changed:
+                self.__queue[i] = changed.pop(path)
+
+        self.__queue.extend(changed.values()) # new songs
+        self.__song_model.refresh()
+
     def queue_thread(self, worker: PlayerWorker):
         """
         Queue management thread.
@@ -132,19 +175,38 @@ class Widget(QtWidgets.QWidget):
         #     self.__length = info["duration"]
 
         worker.start()
+        transitions = self.player.transitions
+        restart = self.__queue.resume # a restored queue picks up from the track that was playing
         while self.__alive:
-            if (not self.player.is_playing()[1] and not self.__paused) and (self.__queue and self.__index < len(self.__queue)-1):                
-                self.__index += 1
-                self.__current_song = self.__queue[self.__index]
+            if self.player.transitions != transitions: # the player moved on to the hinted track by itself
+                transitions = self.player.transitions
+                if self.__queue.upcoming():
+                    self.__queue.position += 1
+                    self.__current_song = self.__queue.current
+                    self.__length = self.__current_song["info"]["duration"]
+
+            if restart is not None and restart != self.__queue.current_id: # moved elsewhere in the meantime
+                restart = None
+            if (not self.player.is_playing()[1] and not self.__paused) and (restart is not None or self.__queue.upcoming()):
+                if restart is None:
+                    self.__queue.position += 1
+                restart = None
+                self.__current_song = self.__queue.current
                 self.player.stop() # ensure that we stop anything currently playing
-                self.player.play(self.__current_song["info"]["path"], self.__current_song["info"]["type"])
+                self.player.play(self.__current_song["info"]["path"], self.__current_song["info"]["type"], self.__current_song["id"])
                 self.__length = self.__current_song["info"]["duration"]
                 self.__paused = False
 
+            # let the player prepare whatever comes next, so there's no gap between tracks
+            upcoming = self.__queue.upcoming()
+            if self.__current_song and upcoming and self.__queue.position > -1:
+                self.player.queue_next(upcoming["info"]["path"], upcoming["info"]["type"], upcoming["id"])
+            else:
+                self.player.queue_next(None)
 
-            progress = int((self.player.get_time()/self.__length)*100)
-            worker.percentage = progress
-            worker.title = f"{self.__current_song["info"]["artist"]} - {self.__current_song["info"]["title"]}"
+            song = self.__current_song # None until something plays, e.g. when a restored queue has nothing left
+            worker.percentage = int((self.player.get_time()/self.__length)*100) if song and self.__length else 0
+            worker.title = f"{song["info"]["artist"]} - {song["info"]["title"]}" if song else ""
             # print(worker.percentage)
             time.sleep(0.5)
         worker.finish()
@@ -173,13 +235,13 @@ class Widget(QtWidgets.QWidget):
 
     def previous(self):
         if self.player.get_time() > 5:
-            self.__index -= 1
+            self.__queue.position -= 1
             self.player.stop()
             self.__current_song = None
-        elif self.__index <= 0:
+        elif self.__queue.position <= 0:
             pass
         else:
-            self.__index -= 2
+            self.__queue.position -= 2
             self.player.stop()
             self.__current_song = None
 
@@ -203,17 +265,22 @@ class Widget(QtWidgets.QWidget):
 
     # ensure we cleanup before closing
     def closeEvent(self, a0):
-        self.player.stop()
+        self.player.exit()
+        if self.watcher:
+            self.watcher.stop()
         log.info("graceful(?) program exit. goodbye!")
         return super().closeEvent(a0)
 
 
-def launch_qt():
+def launch_qt(watcher=None, player=None):
     """
     Helper function to launch the GUI.
+
+    If a `watcher.LibraryWatcher` is supplied, library changes will show up without restarting.
+    A `player` can be supplied to use instead of the default `Player` (see `main.create_player`).
     """
     app = QtWidgets.QApplication(sys.argv)
-    w = Widget()
+    w = Widget(watcher=watcher, player=player)
     w.show()
     sys.exit(app.exec_())
 
@@ -0,0 +1,151 @@
+"""
+Precomputed album and artist indexes over the library.
+"""
+from bisect import insort
+
+def track_key(song: dict) -> int:
+    return song["info"]["track"] or 0
+
+class Album:
+    """
+    A single album and its tracks, sorted by track number.
+
+    `id` is a stable integer that won't be reused, even if the album is removed.
+    """
+    def __init__(self, id: int, title: str):
+        self.id = id
+        self.title = title
+        self.tracks = []
+
+    @property
+    def artist(self) -> str | None:
+        """
+        The album artist of the first track, or its artist if it doesn't have one.
+        """
+        if not self.tracks:
+            return None
+        info = self.tracks[0]["info"]
+        return info["album_artist"] or info["artist"]
+
+    def __len__(self) -> int:
+        return len(self.tracks)
+
+class LibraryIndex:
+    """
+    Maps albums to their (track sorted) tracks, and artists to their albums.
+
+    Built once when the library is loaded, then kept up to date with `add`, `remove` and `apply`, so looking
+    up an album only costs as much as the album itself.
+    """
+    def __init__(self, songs = ()):
+        self.version = 0 # increases on every change, so views know when to rebuild
+
+        self.__albums = {} # title -> Album, in the order they were first seen
+        self.__ids = {} # id -> Album
+        self.__artists = {} # artist -> {album id: track count}
+        self.__paths = {} # path -> song
+        self.__next_id = 0
+        self.__album_list = None
+
+        for song in songs:
+            self.add(song)
+
+    def __len__(self) -> int:
+        return len(self.__paths)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.__paths
+
+    def _artists_of(self, song: dict) -> set:
+        info = song["info"]
+        return {_ for _ in (info["artist"], info["album_artist"]) if _ is not None}
+
+    def add(self, song: dict):
+        """
+        Add a song to the index, replacing any song that has the same path.
+        """
+        path = song["info"]["path"]
+        if path in self.__paths:
+            self.remove(path)
+
+        title = song["info"]["album"]
+        album = self.__albums.get(title)
+        if album is None:
+            album = Album(self.__next_id, title)
+            self.__next_id += 1
+            self.__albums[title] = album
+            self.__ids[album.id] = album
+            self.__album_list = None
+
+        insort(album.tracks, song, key=track_key) # stays stable for tracks with the same number
+        for artist in self._artists_of(song):
+            counts = self.__artists.setdefault(artist, {})
+            counts[album.id] = counts.get(album.id, 0) + 1
+
+        self.__paths[path] = song
+        self.version += 1
+
+    def remove(self, path: str) -> dict | None:
+        """
+        Remove a song by its path, returning it if it existed.
+        """
+        song = self.__paths.pop(path, None)
+        if song is None:
+            return None
+
+        album = self.__albums[song["info"]["album"]]
+        album.tracks.remove(song)
+        if not album.tracks:
+            del self.__albums[album.title]
+            del self.__ids[album.id]
+            self.__album_list = None
+
+        for artist in self._artists_of(song):
+            counts = self.__artists[artist]
+            counts[album.id] -= 1
+            if not counts[album.id]:
+                del counts[album.id]
+            if not counts:
+                del self.__artists[artist]
+
+        self.version += 1
+        return song
+
+    def apply(self, updated: list, removed: list):
+        """
+        Apply a set of changes from `watcher.LibraryWatcher`.
+        """
+        for path in removed:
+            self.remove(path)
+        for song in updated:
+            self.add(song)
+
+    def albums(self) -> list:
+        """
+        Every album, in the order they were first seen.
+        """
+        if self.__album_list is None:
+            self.__album_list = list(self.__albums.values())
+        return self.__album_list
+
+    def album(self, title: str) -> Album | None:
+        return self.__albums.get(title)
+
+    def album_by_id(self, id: int) -> Album | None:
+        return self.__ids.get(id)
+
+    def tracks(self, title: str) -> list:
+        """
+        Every track in an album, sorted by track number.
+        """
+        album = self.__albums.get(title)
+        return album.tracks if album else []
+
+    def albums_by_artist(self, artist: str) -> list:
+        """
+        Every album an artist (or album artist) appears on.
+        """
+        return [self.__ids[_] for _ in self.__artists.get(artist, {})]
+
+    def song(self, path: str) -> dict | None:
+        return self.__paths.get(path)
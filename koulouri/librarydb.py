@@ -0,0 +1,150 @@
+"""
+Optional SQLite backend for the `songcache`.
+
+Rows are stored with indexed columns, allowing frontends to query only the tracks they need
+instead of loading (and sorting) the entire library on startup.
+"""
+import sqlite3
+
+COLUMNS = ["id", "path", "type", "duration", "artist", "album_artist", "album", "title", "genre", "track",
+           "mtime", "size", "inode"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    id TEXT NOT NULL,
+    path TEXT PRIMARY KEY,
+    type TEXT,
+    duration REAL,
+    artist TEXT,
+    album_artist TEXT,
+    album TEXT,
+    title TEXT,
+    genre TEXT,
+    track INTEGER,
+    mtime INTEGER,
+    size INTEGER,
+    inode INTEGER
+);
+CREATE INDEX IF NOT EXISTS tracks_id ON tracks (id);
+CREATE INDEX IF NOT EXISTS tracks_album ON tracks (album, track);
+CREATE INDEX IF NOT EXISTS tracks_artist ON tracks (artist);
+CREATE INDEX IF NOT EXISTS tracks_album_artist ON tracks (album_artist);
+CREATE INDEX IF NOT EXISTS tracks_track ON tracks (track);
+"""
+
+# rowid keeps the order the songs were scanned in, matching a stable sort of the JSON cache
+ORDERS = {
+    "album": "album, rowid",
+    "artist": "artist, album, track, rowid",
+    "title": "title, rowid",
+    "scan": "rowid",
+}
+
+class LibraryDB:
+    """
+    An indexed, SQLite backed track library.
+
+    Tracks are returned in the same `{"id": ..., "info": {...}, "stat": {...}}` form used by `songcache.json`.
+    """
+    def __init__(self, path: str = "songcache.db"):
+        self.path = path
+        self.__conn = sqlite3.connect(path, check_same_thread=False)
+        self.__conn.executescript(SCHEMA)
+
+    @staticmethod
+    def _to_row(entry: dict) -> tuple:
+        info = entry["info"]
+        stat = entry.get("stat") or {}
+        return (entry["id"], info["path"], info["type"], info["duration"], info["artist"], info["album_artist"],
+                info["album"], info["title"], info["genre"], info["track"],
+                stat.get("mtime"), stat.get("size"), stat.get("inode"))
+
+    @staticmethod
+    def _to_entry(row: tuple) -> dict:
+        (tid, path, type, duration, artist, album_artist, album, title, genre, track, mtime, size, inode) = row
+        entry = {
+            "id": tid,
+            "info": {"path": path, "type": type, "duration": duration, "artist": artist, "album_artist": album_artist,
+                     "album": album, "title": title, "genre": genre, "track": track},
+        }
+        if mtime is not None:
+            entry["stat"] = {"mtime": mtime, "size": size, "inode": inode}
+        return entry
+
+    def _select(self, where: str = "", params: tuple = (), order: str = "album", limit: int = -1, offset: int = 0) -> list:
+        query = f"SELECT {', '.join(COLUMNS)} FROM tracks {where} ORDER BY {ORDERS[order]} LIMIT ? OFFSET ?"
+        return [self._to_entry(_) for _ in self.__conn.execute(query, params + (limit, offset))]
+
+    def replace(self, entries: list):
+        """
+        Replace the entire library with `entries`.
+        """
+        with self.__conn:
+            self.__conn.execute("DELETE FROM tracks")
+            self.__conn.executemany(f"INSERT OR REPLACE INTO tracks VALUES ({', '.join('?' * len(COLUMNS))})",
+                                    (self._to_row(_) for _ in entries))
+
+    def upsert(self, entries: list):
+        """
+        Add or update tracks, keyed by their path.
+        """
+        with self.__conn:
+            self.__conn.executemany(f"INSERT OR REPLACE INTO tracks VALUES ({', '.join('?' * len(COLUMNS))})",
+                                    (self._to_row(_) for _ in entries))
+
+    def remove(self, paths: list):
+        """
+        Remove tracks by their path.
+        """
+        with self.__conn:
+            self.__conn.executemany("DELETE FROM tracks WHERE path = ?", ((_,) for _ in paths))
+
+    def count(self) -> int:
+        return self.__conn.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+
+    def get(self, tid: str) -> dict | None:
+        """
+        Fetch a track by its TID, if it exists.
+        """
+        rows = self._select("WHERE id = ?", (tid,), "scan", 1)
+        return rows[0] if rows else None
+
+    def page(self, offset: int = 0, limit: int = 50, order: str = "album") -> list:
+        """
+        Fetch a slice of the library, sorted by `order` ("album", "artist", "title" or "scan").
+        """
+        return self._select(order=order, limit=limit, offset=offset)
+
+    def all(self, order: str = "album") -> list:
+        return self._select(order=order)
+
+    def tracks_by_album(self, album: str) -> list:
+        """
+        Fetch every track in an album, sorted by track number.
+        """
+        query = f"SELECT {', '.join(COLUMNS)} FROM tracks WHERE album = ? ORDER BY track, rowid"
+        return [self._to_entry(_) for _ in self.__conn.execute(query, (album,))]
+
+    def albums(self) -> list:
+        """
+        Fetch every album title, in the order they were first scanned.
+        """
+        query = "SELECT album FROM tracks GROUP BY album ORDER BY MIN(rowid)"
+        return [_[0] for _ in self.__conn.execute(query)]
+
+    def albums_by_artist(self, artist: str) -> list:
+        """
+        Fetch every album an artist (or album artist) appears on.
+        """
+        query = ("SELECT album FROM tracks WHERE artist = ? UNION SELECT album FROM tracks WHERE album_artist = ?"
+                 " ORDER BY album")
+        return [_[0] for _ in self.__conn.execute(query, (artist, artist))]
+
+    def paths(self) -> dict:
+        """
+        Fetch a dict of path -> track, used for incremental refreshes.
+        """
+        return {_["info"]["path"]: _ for _ in self._select(order="scan")}
+
+    def close(self):
+        self.__conn.close()
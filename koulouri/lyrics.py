@@ -0,0 +1,111 @@
+"""
+LRC lyrics parsing.
+
+Lyrics are parsed once per file into a sorted list of timestamps, so finding the current line is a
+binary search. Parsed files are kept in a small LRU shared by every player (see `load`).
+"""
+import os
+import re
+import bisect
+import logging
+from functools import lru_cache
+
+CACHE_SIZE = 32 # parsed lyric files to keep around
+
+TAG = re.compile(r"\[([^\]]*)\]")
+TIME = re.compile(r"(\d+):(\d+)(?:[.:](\d+))?") # mm:ss, mm:ss.xx, mm:ss:xx
+WORD_TIME = re.compile(r"<\d+:\d+(?:[.:]\d+)?>") # enhanced LRC per word timings, not used
+
+class Lyrics:
+    """
+    Timed lyric lines, sorted by time.
+
+    Behaves like a list of the lines themselves, `times[i]` being when `lines[i]` starts (in seconds).
+    """
+    def __init__(self, times: list[float] | None = None, lines: list[str] | None = None):
+        self.times = times or []
+        self.lines = lines or []
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def __getitem__(self, i):
+        return self.lines[i]
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def line_at(self, seconds: float) -> int:
+        """
+        Index of the line being sung at `seconds`, or -1 if the first line hasn't started yet.
+        """
+        return bisect.bisect_right(self.times, seconds) - 1
+
+def _time(tag: str) -> float | None:
+    match = TIME.fullmatch(tag.strip())
+    if not match:
+        return None
+    minutes, seconds, fraction = match.groups()
+    t = int(minutes) * 60 + int(seconds)
+    if fraction:
+        t += int(fraction) / 10 ** len(fraction)
+    return t
+
+def parse(text: str) -> Lyrics:
+    """
+    Parse the contents of an LRC file.
+
+    A line can have several timestamps (`[00:12.00][01:30.00]chorus`), in which case it shows up once for
+    each of them. The `[offset:ms]` tag is applied to every timestamp, other tags are ignored.
+    """
+    entries = []
+    offset = 0.0
+
+    for line in text.splitlines():
+        stamps = []
+        pos = 0
+        while match := TAG.match(line, pos):
+            tag = match.group(1)
+            t = _time(tag)
+            if t is not None:
+                stamps.append(t)
+            elif tag.lower().startswith("offset:"):
+                try:
+                    offset = int(tag[7:].strip()) / 1000 # positive values show lyrics sooner
+                except ValueError:
+                    pass
+            pos = match.end()
+
+        if stamps:
+            lyric = WORD_TIME.sub("", line[pos:]).strip()
+            entries.extend((t, lyric) for t in stamps)
+
+    entries.sort(key=lambda _: _[0]) # stable, so lines with equal times keep their order
+    return Lyrics([max(t - offset, 0.0) for t, _ in entries], [lyric for _, lyric in entries])
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _load(path: str, mtime: int) -> Lyrics:
+    # mtime is only part of the key, so an edited file is parsed again
+    try:
+        with open(path, "r", encoding="utf-8-sig", errors="replace") as f:
+            return parse(f.read())
+    except OSError as e:
+        logging.warning(f"unable to read lyrics from '{path}': {e}")
+        return Lyrics()
+
+def lyrics_path(path: str) -> str:
+    """
+    Where the lyrics of the audio file at `path` would be.
+    """
+    return os.path.splitext(path)[0] + ".lrc"
+
+def load(path: str) -> Lyrics:
+    """
+    Fetch the lyrics of the audio file at `path`. Returns empty `Lyrics` if it doesn't have any.
+    """
+    lrc = lyrics_path(path)
+    try:
+        mtime = os.stat(lrc).st_mtime_ns
+    except OSError:
+        return Lyrics()
+    return _load(lrc, mtime)
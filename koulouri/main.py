@@ -2,72 +2,340 @@ import argparse
 import json
 import os, sys
 import hashlib
+import threading
+import metadata
+from fnmatch import fnmatch
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide" # hide pygame welcome
 from player_pyaudio import Player
+from pcmcache import DEFAULT_BUDGET
+from librarydb import LibraryDB
+from library import LibraryIndex
+from search import SearchIndex
+from bincache import BinaryCache, CacheFormatError, write_cache, export_json, import_json
 from time import sleep, time
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-p", "--play", help="Play a song, artist, or albumb.", type=int)
 parser.add_argument("-l", "--list", help="List all available songs, albums, or artists.", action="store_true")
+parser.add_argument("-s", "--search", help="Search your library by title, artist, or album.")
 parser.add_argument("-r", "--refresh", help="Refresh Koulouri's song cache.", action="store_true")
 parser.add_argument("-c", "--curses", help="Run the Curses-based frontend instead.", action="store_true")
 parser.add_argument("-g", "--gui", help="Run the Qt-based frontend instead.", action="store_true")
 parser.add_argument("-v", "--version", help="Print Koulouri's version, then exit.", action="store_true")
 parser.add_argument("--album", help="Set supported commands to Album Mode.", action="store_true")
 parser.add_argument("--add-source", help="Add a folder to your library.", action="append")
+parser.add_argument("--incremental", help="Only re-scan new or changed files when refreshing.", action="store_true")
+parser.add_argument("--include", help="Only scan files matching this glob. Can be supplied multiple times.", action="append")
+parser.add_argument("--exclude", help="Skip files and folders matching this glob. Can be supplied multiple times.", action="append")
+parser.add_argument("--db", help="Store the library in an indexed SQLite database (songcache.db).", action="store_true")
+parser.add_argument("-w", "--watch", help="Watch your library for changes while the TUI/GUI is running.", action="store_true")
+parser.add_argument("--export-json", help="Export the song cache as JSON to this path.")
+parser.add_argument("--import-json", help="Replace the song cache with a JSON export from this path.")
+parser.add_argument("--workers", help="Number of files to probe at once when refreshing.", type=int)
+parser.add_argument("--processes", help="Probe files using worker processes instead of threads.", action="store_true")
+parser.add_argument("--cache-size", help="Size of the decoded audio cache in MiB (0 to disable).", type=int)
+parser.add_argument("--hires", help="Play tracks in their native sample rate, bit depth and channels when possible.", action="store_true")
+parser.add_argument("--engine", help="Run the audio engine in its own process.", action="store_true")
 
 VERSION = "2.0.0"
+CACHE_PATH = "songcache.bin"
+LEGACY_CACHE_PATH = "songcache.json"
+
+def matches(path: str, patterns: list | None) -> bool:
+    """
+    Whether or not a path (or its name) matches any of the supplied glob patterns.
+    """
+    if not patterns:
+        return False
+    name = path.rsplit("/", 1)[-1]
+    return any(fnmatch(path, _) or fnmatch(name, _) for _ in patterns)
+
+def walk_songs(dir, include: list | None = None, exclude: list | None = None):
+    """
+    Walk a directory, yielding a (path, type) tuple for every song as soon as it is found.
+
+    Uses an explicit stack of `os.scandir` iterators rather than recursion, so the file type of each entry
+    comes from the directory listing itself. Directories are only visited once (by device and inode), which
+    stops symlink loops from walking forever.
+
+    `include` and `exclude` are glob patterns matched against the path relative to `dir` (or the entry's
+    name). excluded directories are skipped entirely, while `include` only applies to files.
+    """
+    root = os.stat(dir) # raises FileNotFoundError if the source doesn't exist
+    seen = {(root.st_dev, root.st_ino)}
+    stack = [(dir, os.scandir(dir))]
+
+    try:
+        while stack:
+            parent, entries = stack[-1]
+            entry = next(entries, None)
+            if entry is None:
+                stack.pop()[1].close()
+                continue
 
-def assemble_songs(dir):
-    output = []
-
-    for song in os.listdir(dir):
-        if os.path.isdir(f"{dir}/{song}"):
-            output.extend(assemble_songs(f"{dir}/{song}")) # recursive
-        elif song.split(".")[-1] in ["flac", "mp3"]:
-            output.append((f"{dir}/{song}", song.split(".")[-1]))
-        # print(song.split("."))
-
-    return output
+            path = f"{parent}/{entry.name}"
+            relative = path[len(dir)+1:]
+            try:
+                if entry.is_dir():
+                    if matches(relative, exclude):
+                        continue
+                    stat = entry.stat() # one call per directory, not per file
+                    if not stat.st_ino: # windows doesn't fill these in from the directory listing
+                        stat = os.stat(path)
+                    if (stat.st_dev, stat.st_ino) in seen: # symlink loop (or a second link to the same folder)
+                        continue
+                    seen.add((stat.st_dev, stat.st_ino))
+                    stack.append((path, os.scandir(path)))
+                    continue
+            except OSError: # broken link or no permission
+                continue
 
-def generate_cache(dir):
-    songs = assemble_songs(dir)
+            type = entry.name.split(".")[-1]
+            if type not in ["flac", "mp3"]:
+                continue
+            if matches(relative, exclude) or (include and not matches(relative, include)):
+                continue
+            yield (path, type)
+    finally:
+        for _, entries in stack:
+            entries.close()
+
+def assemble_songs(dir, include: list | None = None, exclude: list | None = None):
+    """
+    Assemble a list of every song inside of a directory. See `walk_songs`.
+    """
+    return list(walk_songs(dir, include, exclude))
+
+def fingerprint(path: str) -> dict:
+    """
+    Fetch the values used to tell if a file has changed since it was last scanned.
+    """
+    stat = os.stat(path)
+    return {"mtime": stat.st_mtime_ns, "size": stat.st_size, "inode": stat.st_ino}
+
+class ScanProgress:
+    """
+    Thread-safe counter used to report how many files have been probed during a scan.
+    """
+    def __init__(self, quiet: bool = False):
+        self.__lock = threading.Lock()
+        self.__quiet = quiet
+        self.found = 0
+        self.done = 0
+
+    def add(self, count: int = 1):
+        """
+        Inform the counter that more files need to be probed.
+        """
+        with self.__lock:
+            self.found += count
+
+    def finish(self, *_):
+        """
+        Mark a single file as probed. Can be used as a `Future` callback.
+        """
+        with self.__lock:
+            self.done += 1
+            if not self.__quiet:
+                print(f"\rprobed {self.done} of {self.found} files...", end="", flush=True)
+
+def probe_song(song: tuple, stat: dict) -> dict:
+    """
+    Probe a single song and return its cache entry.
+
+    Safe to call from any number of worker threads or processes at once.
+    """
+    info = metadata.probe(song[0], song[1])
+    # create a unique id for each track that can persist
+    tid = hashlib.sha256(f"{info["artist"]}{info["title"]}".encode()).hexdigest()
+    return {"id": tid, "info": info, "stat": stat}
+
+def create_pool(workers: int | None = None, processes: bool = False):
+    """
+    Create the worker pool used to probe files.
+
+    Threads are used by default, since most of the work happens inside of ffprobe anyway.
+    """
+    workers = workers or os.cpu_count() or 1
+    if processes:
+        return ProcessPoolExecutor(max_workers=workers)
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="koulouri-probe")
+
+def generate_cache(dir, previous: dict | None = None, pool = None, progress: ScanProgress | None = None,
+                   include: list | None = None, exclude: list | None = None):
+    """
+    Scan a directory and assemble a list of song metadata.
+
+    If `previous` (a dict of path -> cache entry) is supplied, files whose fingerprint hasn't changed
+    will reuse their old entry instead of being probed again. Probing is handed off to `pool`, but the
+    output will always be in the same order as the directory walk.
+
+    Files are handed to the pool while the walk is still running.
+    """
+    songs = walk_songs(dir, include, exclude)
     song_meta = []
 
-    plr = Player()
+    own_pool = pool is None
+    if own_pool:
+        pool = create_pool()
 
-    for song in songs:
-        info = plr.get_info(song[0], song[1])
-        # create a unique id for each track that can persist
-        tid = hashlib.sha256(f"{info["artist"]}{info["title"]}".encode()).hexdigest()
-        song_meta.append({"id": tid, "info": info})
+    try:
+        for song in songs:
+            try:
+                stat = fingerprint(song[0])
+            except OSError: # removed while we were scanning
+                continue
 
-    return song_meta
+            old = previous.get(song[0]) if previous else None
+            if old and old.get("stat") == stat:
+                song_meta.append(old)
+                continue
 
-def fetch_cache(force: bool = False, sources: list | None = None) -> dict:
+            future = pool.submit(probe_song, song, stat)
+            if progress:
+                progress.add()
+                future.add_done_callback(progress.finish)
+            song_meta.append(future)
+
+        # resolve in walk order, rather than whichever probe finished first
+        return [_.result() if isinstance(_, Future) else _ for _ in song_meta]
+    finally:
+        if own_pool:
+            pool.shutdown()
+
+def get_sources(sources: list | None = None) -> list:
+    """
+    Fetch the default music folders, along with any extra `sources`.
+    """
+    user = os.environ.get('USER', os.environ.get('USERNAME', "user"))
+    paths = [f"/home/{user}/Music", f"C:/Users/{user}/Music"]
+    if sources:
+        paths.extend(sources)
+    return paths
+
+def open_db(create: bool = False) -> LibraryDB | None:
+    """
+    Open the SQLite library if it's in use, or if `create` is set.
+
+    Returns None when the JSON `songcache` should be used instead.
+    """
+    if create or os.path.exists("songcache.db"):
+        return LibraryDB("songcache.db")
+    return None
+
+def open_cache() -> BinaryCache | None:
+    """
+    Open the binary `songcache`, migrating an old `songcache.json` if needed.
+
+    Returns None if neither exist (or the binary cache is from an incompatible version).
+    """
+    if not os.path.exists(CACHE_PATH) and os.path.exists(LEGACY_CACHE_PATH):
+        write_cache(CACHE_PATH, import_json(LEGACY_CACHE_PATH))
+
+    try:
+        return BinaryCache(CACHE_PATH)
+    except (FileNotFoundError, CacheFormatError):
+        return None
+
+def fetch_cache(force: bool = False, sources: list | None = None, incremental: bool = False,
+                workers: int | None = None, processes: bool = False,
+                include: list | None = None, exclude: list | None = None, db: bool = False):
+    """
+    Load the `songcache`, creating it if it doesn't exist yet.
+
+    `force` will re-scan every source. when `incremental` is also set, only new or changed files are
+    probed, while deleted files are dropped from the cache.
+
+    Sources are walked at the same time, sharing a single pool of `workers` threads (or processes).
+    `include` and `exclude` are passed along to `walk_songs`.
+
+    If `db` is set (or `songcache.db` already exists), the SQLite library is used instead of `songcache.bin`.
+    Otherwise, the returned cache is a lazily decoded `BinaryCache`.
+    """
     out = []
-    if not os.path.exists("songcache.json") or force:
-        user = os.environ.get('USER', os.environ.get('USERNAME', "user"))
-        paths = [f"/home/{user}/Music", f"C:/Users/{user}/Music"]
-        if sources:
-            paths.extend(sources)
+    library = open_db(db)
+    cache = None if library else open_cache()
+    exists = library.count() > 0 if library else bool(cache) # an empty cache is scanned again
+
+    if not exists or force:
+        previous = None
+        if incremental and exists and library:
+            previous = library.paths()
+        elif incremental and exists:
+            previous = {_["info"]["path"]: _ for _ in cache}
+        if cache:
+            cache.close() # about to be replaced
+
+        paths = get_sources(sources)
         print("fetching metadata...")
-        for path in paths:
-            try:
-                song_meta = generate_cache(path)
-                out.extend(song_meta)
-            except FileNotFoundError:
-                continue
+        progress = ScanProgress()
+
+        with create_pool(workers, processes) as pool, ThreadPoolExecutor(max_workers=len(paths)) as walkers:
+            scans = [walkers.submit(generate_cache, path, previous, pool, progress, include, exclude) for path in paths]
+
+            for scan in scans: # keep the same order as `paths`
+                try:
+                    out.extend(scan.result())
+                except FileNotFoundError:
+                    continue
+        if progress.found:
+            print()
         
-        if out:
-            with open("songcache.json", "w") as f:
-                json.dump(out, f)
-                return out
+        if out and library:
+            library.replace(out)
+            return out
+        elif out:
+            write_cache(CACHE_PATH, out)
+            return BinaryCache(CACHE_PATH)
         else:
             raise FileNotFoundError("Unable to locate music folder!")
 
-    with open("songcache.json", "r") as f:
-        return json.load(f)
+    if library:
+        return library.all("scan")
+
+    return cache
+
+def update_cache(updated: list, removed: list):
+    """
+    Apply a set of changes (see `watcher.LibraryWatcher`) to the stored `songcache`, without a full rescan.
+    """
+    library = open_db()
+    if library:
+        library.remove(removed)
+        library.upsert(updated)
+        return
+
+    cache = open_cache()
+    songs = {_["info"]["path"]: _ for _ in cache} if cache else {}
+    if cache:
+        cache.close()
+    for path in removed:
+        songs.pop(path, None)
+    for entry in updated:
+        songs[entry["info"]["path"]] = entry
+    write_cache(CACHE_PATH, list(songs.values()))
+
+def create_player(rpc = None, engine: bool = False, **options):
+    """
+    Create a `Player`, or a `engine.RemotePlayer` running one in its own process if `engine` is set.
+
+    `options` are passed on to the `Player`.
+    """
+    if engine:
+        from engine import RemotePlayer
+        return RemotePlayer(rpc, **options)
+    return Player(rpc, **options)
+
+def create_watcher(sources: list | None = None, include: list | None = None, exclude: list | None = None):
+    """
+    Create (and start) a `LibraryWatcher` over every source, keeping the stored `songcache` up to date.
+    """
+    from watcher import LibraryWatcher
+    watcher = LibraryWatcher(get_sources(sources), fetch_cache(), include=include, exclude=exclude)
+    watcher.add_listener(update_cache)
+    watcher.start()
+    return watcher
 
 
 if __name__ == "__main__":
@@ -78,24 +346,30 @@ if __name__ == "__main__":
         print(f"koulouri v{VERSION} ({os.getcwd()})")
         parser.exit()
 
+    cache_size = args.cache_size * 1024 * 1024 if args.cache_size is not None else DEFAULT_BUDGET
+    player_options = {"engine": args.engine, "cache_size": cache_size, "hires": args.hires}
+
     if args.curses:
         from tui import Window
         try:
             from discord import RPC
             rpc = RPC()
-            plr = Player(rpc)
+            plr = create_player(rpc, **player_options)
         except ModuleNotFoundError: # optional RPC modules not installed
-            plr = Player()
+            plr = create_player(**player_options)
         import curses
 
+        watcher = create_watcher(args.add_source, args.include, args.exclude) if args.watch else None
+
         stdscr = curses.initscr()
-        win = Window(plr, stdscr)
+        win = Window(plr, stdscr, watcher)
         win.main()
 
     if args.gui:
         try:
             from gui import launch_qt
-            launch_qt()
+            launch_qt(create_watcher(args.add_source, args.include, args.exclude) if args.watch else None,
+                      create_player(**player_options))
         except ModuleNotFoundError: # GUI was not included
             parser.exit(1, "failed to load GUI module(s)!\n")
 
@@ -103,13 +377,16 @@ if __name__ == "__main__":
         print("fetching media...")
         # songs = assemble_songs("/home/exii/Music")
         # songs = sorted(songs, key=lambda d: d["track"])
-        song_meta = fetch_cache()
-        songs = sorted(song_meta, key=lambda d: d["info"]["album"])
-        song = songs[args.play]
+        library = open_db()
+        if library: # only fetch the row we need
+            song = library.page(args.play, 1)[0]
+        else:
+            song_meta = fetch_cache()
+            song = song_meta.by_album(args.play) # no need to decode (and sort) every track
 
         if not args.album:
-            plr = Player()
-            info = plr.play(song["info"]["path"], song["info"]["type"])
+            plr = create_player(**player_options)
+            info = plr.play(song["info"]["path"], song["info"]["type"], song["id"])
 
             print(f"Playing {info["title"]} by {info["artist"]}...")
             print("Press q<ENTER> to quit or h<ENTER> for commands.")
@@ -138,16 +415,17 @@ if __name__ == "__main__":
                         print(f"Volume now at {round(plr.mixer.get_volume(), 2)}")
 
             except KeyboardInterrupt:
-                plr.stop()
+                plr.exit()
         if args.album:
-            song_meta = fetch_cache()
-            
-            plr = Player()
+            plr = create_player(**player_options)
             
-            albums = list(dict.fromkeys([_["info"]["album"] for _ in song_meta]))
-
-            queue = [_ for _ in song_meta if _["info"]["album"] == albums[args.play]]
-            queue = sorted(queue, key=lambda d: d["info"]["track"])
+            if library:
+                albums = library.albums()
+                queue = library.tracks_by_album(albums[args.play])
+            else:
+                index = LibraryIndex(song_meta)
+                albums = [_.title for _ in index.albums()]
+                queue = index.tracks(albums[args.play])
             queue_index = 0
 
             print(f"Playing album '{albums[args.play]}' by {queue[0]["info"]["album_artist"]}...")
@@ -157,7 +435,7 @@ if __name__ == "__main__":
                 while queue_index < len(queue):
                     paused = False
                     print(f"Playing {queue[queue_index]["info"]["title"]} by {queue[queue_index]["info"]["artist"]}...")
-                    plr.play(queue[queue_index]["info"]["path"], queue[queue_index]["info"]["type"])
+                    plr.play(queue[queue_index]["info"]["path"], queue[queue_index]["info"]["type"], queue[queue_index]["id"])
 
                     while plr.is_playing()[1] or paused:
                         sleep(1)
@@ -189,16 +467,37 @@ if __name__ == "__main__":
                     plr.stop() # ensure the song is over
                     queue_index += 1
             except KeyboardInterrupt:
-                plr.stop()
+                plr.exit()
+
 
 
+    elif args.import_json:
+        write_cache(CACHE_PATH, import_json(args.import_json))
+    elif args.export_json:
+        library = open_db()
+        export_json(library.all("scan") if library else fetch_cache(), args.export_json)
+    elif args.search:
+        library = open_db()
+        songs = library.all() if library else list(fetch_cache().sorted_by_album())
+        positions = {_["info"]["path"]: i for i, _ in enumerate(songs)} # the same numbers --play uses
 
+        for song in SearchIndex(songs).search(args.search, 25):
+            print(f"{positions[song["info"]["path"]]} : {song["info"]["artist"]} - {song["info"]["title"]}")
     elif args.refresh:
-        fetch_cache(True, args.add_source)
+        fetch_cache(True, args.add_source, args.incremental, args.workers, args.processes,
+                    args.include, args.exclude, args.db)
     elif args.list:
-        song_meta = fetch_cache()
-        songs = sorted(song_meta, key=lambda d: d["info"]["album"])
+        library = open_db()
 
         print("Your Library:")
-        for i, song in enumerate(songs):
-            print(f"{i} : {song["info"]["artist"]} - {song["info"]["title"]}")
+        if library: # page through the library instead of loading it all at once
+            i = 0
+            while page := library.page(i, 500):
+                for song in page:
+                    print(f"{i} : {song["info"]["artist"]} - {song["info"]["title"]}")
+                    i += 1
+        else:
+            song_meta = fetch_cache()
+
+            for i, song in enumerate(song_meta.sorted_by_album()):
+                print(f"{i} : {song["info"]["artist"]} - {song["info"]["title"]}")
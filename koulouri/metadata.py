@@ -0,0 +1,389 @@
+"""
+Pure Python metadata readers.
+
+Only the headers of a file are read, making these much cheaper than spawning ffprobe for every
+track. Readers live inside of `READERS`, keyed by the same file type used everywhere else, so
+supporting a new format only requires writing a function that returns a `Header`.
+"""
+import os
+import struct
+
+class MetadataError(ValueError):
+    """
+    Raised when a file's headers can't be understood. Callers should fall back to ffprobe.
+    """
+    pass
+
+class Header:
+    """
+    Everything a reader could find inside of a file's headers.
+
+    `tags` uses the same (lowercase) names as the info dict returned by `read_info`.
+    """
+    def __init__(self, tags: dict, duration: float, sample_rate: int = 0, channels: int = 0, bits: int = 0):
+        self.tags = tags
+        self.duration = duration
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.bits = bits
+
+def parse_track(value) -> int:
+    """
+    Convert a track tag into an int, ignoring things like a total count ("3/12").
+    """
+    if value is None:
+        return 0
+    digits = ""
+    for char in str(value).strip():
+        if not char.isdigit():
+            break
+        digits += char
+    return int(digits) if digits else 0
+
+# FLAC
+
+VORBIS_KEYS = {
+    "ARTIST": "artist",
+    "ALBUMARTIST": "album_artist",
+    "ALBUM ARTIST": "album_artist",
+    "ALBUM_ARTIST": "album_artist",
+    "ALBUM": "album",
+    "TITLE": "title",
+    "GENRE": "genre",
+    "TRACKNUMBER": "track",
+    "TRACK": "track",
+}
+
+def read_vorbis_comment(data: bytes) -> dict:
+    """
+    Parse a Vorbis comment block, as used by FLAC (and Ogg/Opus).
+
+    Repeated fields are joined with a ';', matching ffprobe.
+    """
+    tags = {}
+    vendor_len = struct.unpack_from("<I", data, 0)[0]
+    pos = 4 + vendor_len
+    count = struct.unpack_from("<I", data, pos)[0]
+    pos += 4
+
+    for _ in range(count):
+        length = struct.unpack_from("<I", data, pos)[0]
+        pos += 4
+        comment = data[pos:pos+length].decode("utf-8", "replace")
+        pos += length
+
+        key, sep, value = comment.partition("=")
+        name = VORBIS_KEYS.get(key.upper())
+        if not sep or not name:
+            continue
+        tags[name] = f"{tags[name]};{value}" if name in tags else value
+
+    return tags
+
+def read_flac(f) -> Header:
+    start = skip_id3v2(f) # some taggers put ID3 in front of FLAC files
+    f.seek(start)
+    if f.read(4) != b"fLaC":
+        raise MetadataError("missing fLaC marker")
+
+    tags = {}
+    streaminfo = None
+    last = False
+    while not last:
+        block = f.read(4)
+        if len(block) < 4:
+            raise MetadataError("truncated metadata block")
+        last = bool(block[0] & 0x80)
+        kind = block[0] & 0x7F
+        length = int.from_bytes(block[1:4], "big")
+
+        if kind == 0: # STREAMINFO
+            streaminfo = f.read(length)
+        elif kind == 4: # VORBIS_COMMENT
+            tags = read_vorbis_comment(f.read(length))
+        else: # pictures, padding, seek tables...
+            f.seek(length, os.SEEK_CUR)
+
+    if not streaminfo or len(streaminfo) < 18:
+        raise MetadataError("missing STREAMINFO")
+
+    # 20 bits sample rate, 3 bits channels, 5 bits bits per sample, 36 bits total samples
+    packed = int.from_bytes(streaminfo[10:18], "big")
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    bits = ((packed >> 36) & 0x1F) + 1
+    total_samples = packed & 0xFFFFFFFFF
+
+    if not sample_rate:
+        raise MetadataError("invalid sample rate")
+
+    return Header(tags, total_samples / sample_rate, sample_rate, channels, bits)
+
+# MP3
+
+ID3_FRAMES = {
+    "TPE1": "artist", "TP1": "artist",
+    "TPE2": "album_artist", "TP2": "album_artist",
+    "TALB": "album", "TAL": "album",
+    "TIT2": "title", "TT2": "title",
+    "TCON": "genre", "TCO": "genre",
+    "TRCK": "track", "TRK": "track",
+}
+
+ID3_ENCODINGS = {0: "latin-1", 1: "utf-16", 2: "utf-16-be", 3: "utf-8"}
+
+def syncsafe(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+def skip_id3v2(f) -> int:
+    """
+    Return the offset of the first byte after any ID3v2 tag at the start of the file.
+    """
+    f.seek(0)
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b"ID3":
+        return 0
+    size = syncsafe(header[6:10]) + 10
+    if header[5] & 0x10: # footer present
+        size += 10
+    return size
+
+def decode_text_frame(data: bytes) -> str | None:
+    if not data:
+        return None
+    encoding = ID3_ENCODINGS.get(data[0])
+    if not encoding:
+        return None
+    text = data[1:].decode(encoding, "replace")
+    values = [_.strip("\ufeff") for _ in text.split("\x00") if _.strip("\ufeff")]
+    return ";".join(values) if values else None
+
+def remove_unsync(data: bytes) -> bytes:
+    return data.replace(b"\xff\x00", b"\xff")
+
+def read_id3v2(f) -> dict:
+    f.seek(0)
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b"ID3":
+        return {}
+
+    version = header[3]
+    flags = header[5]
+    data = f.read(syncsafe(header[6:10]))
+
+    if version < 4 and flags & 0x80: # whole tag unsynchronised
+        data = remove_unsync(data)
+
+    pos = 0
+    if flags & 0x40 and version >= 3: # skip the extended header
+        if version == 4:
+            pos = syncsafe(data[0:4])
+        else:
+            pos = struct.unpack_from(">I", data, 0)[0] + 4
+
+    tags = {}
+    id_len, head_len = (3, 6) if version == 2 else (4, 10)
+    while pos + head_len <= len(data):
+        frame_id = data[pos:pos+id_len]
+        if not frame_id.strip(b"\x00") or not frame_id.isalnum():
+            break # reached padding
+
+        if version == 2:
+            size = int.from_bytes(data[pos+3:pos+6], "big")
+            frame_flags = 0
+        elif version == 4:
+            size = syncsafe(data[pos+4:pos+8])
+            frame_flags = int.from_bytes(data[pos+8:pos+10], "big")
+        else:
+            size = struct.unpack_from(">I", data, pos+4)[0]
+            frame_flags = 0
+
+        body = data[pos+head_len:pos+head_len+size]
+        pos += head_len + size
+
+        name = ID3_FRAMES.get(frame_id.decode("latin-1"))
+        if not name or name in tags:
+            continue
+        if version == 4 and frame_flags & 0x02: # per-frame unsynchronisation
+            body = remove_unsync(body)
+        if version == 4 and frame_flags & 0x01: # data length indicator
+            body = body[4:]
+        if frame_flags & 0x0C: # compressed or encrypted, let ffprobe handle it
+            continue
+
+        value = decode_text_frame(body)
+        if value is not None:
+            tags[name] = value
+
+    return tags
+
+def read_id3v1(f) -> dict:
+    f.seek(-128, os.SEEK_END)
+    data = f.read(128)
+    if data[:3] != b"TAG":
+        return {}
+
+    def text(raw: bytes):
+        return raw.split(b"\x00")[0].decode("latin-1").strip() or None
+
+    tags = {"title": text(data[3:33]), "artist": text(data[33:63]), "album": text(data[63:93])}
+    if data[125] == 0 and data[126]: # ID3v1.1 track number
+        tags["track"] = str(data[126])
+    return {k: v for k, v in tags.items() if v is not None}
+
+MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+MP3_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 2.5: [11025, 12000, 8000]}
+
+def parse_frame_header(header: bytes):
+    """
+    Parse a 4 byte MPEG audio frame header.
+
+    Returns a tuple of (version, layer, bitrate, sample rate, channels), or None if it isn't valid.
+    """
+    if header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = {0: 2.5, 2: 2, 3: 1}.get((header[1] >> 3) & 0x3)
+    layer = {1: 3, 2: 2, 3: 1}.get((header[1] >> 1) & 0x3)
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x3
+    if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    bitrate = MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+    channels = 1 if header[3] >> 6 == 3 else 2
+    return version, layer, bitrate, sample_rate, channels
+
+def read_mp3(f) -> Header:
+    tags = read_id3v2(f)
+    start = skip_id3v2(f)
+    size = f.seek(0, os.SEEK_END)
+
+    if not tags and size >= 128:
+        tags = read_id3v1(f)
+
+    # find the first frame, allowing for a bit of junk after the tag
+    f.seek(start)
+    window = f.read(65536)
+    frame = None
+    for i in range(len(window) - 4):
+        if window[i] == 0xFF:
+            frame = parse_frame_header(window[i:i+4])
+            if frame:
+                break
+    if not frame:
+        raise MetadataError("no MPEG audio frame found")
+
+    version, layer, bitrate, sample_rate, channels = frame
+    frame_data = window[i:]
+    if layer == 1:
+        samples_per_frame = 384
+    elif layer == 2 or version == 1:
+        samples_per_frame = 1152
+    else:
+        samples_per_frame = 576
+
+    # VBR files store a frame count in a Xing/Info or VBRI header inside of the first frame
+    if version == 1:
+        xing_at = 36 if channels == 2 else 21
+    else:
+        xing_at = 21 if channels == 2 else 13
+    frames = None
+    if frame_data[xing_at:xing_at+4] in (b"Xing", b"Info"):
+        flags = struct.unpack_from(">I", frame_data, xing_at+4)[0]
+        if flags & 0x1:
+            frames = struct.unpack_from(">I", frame_data, xing_at+8)[0]
+    elif frame_data[36:40] == b"VBRI":
+        frames = struct.unpack_from(">I", frame_data, 36+14)[0]
+
+    if frames:
+        duration = frames * samples_per_frame / sample_rate
+    else: # assume a constant bitrate
+        audio_end = size - 128 if size >= 128 and read_id3v1(f) else size
+        duration = (audio_end - start - i) * 8 / bitrate
+
+    return Header(tags, duration, sample_rate, channels, 16)
+
+READERS = {
+    "flac": read_flac,
+    "mp3": read_mp3,
+}
+
+def read_header(path: str, type: str) -> Header:
+    """
+    Read the headers of a file using the reader for `type`.
+
+    Raises `MetadataError` if the type isn't supported or the file couldn't be parsed.
+    """
+    reader = READERS.get(type)
+    if not reader:
+        raise MetadataError(f"no reader for '{type}' files")
+
+    with open(path, "rb") as f:
+        try:
+            return reader(f)
+        except (struct.error, IndexError, OSError, UnicodeError) as e:
+            raise MetadataError(f"malformed {type} headers: {e}") from e
+
+def read_info(path: str, type: str) -> dict:
+    """
+    Assemble the same info dict as `probe` without spawning ffprobe.
+    """
+    header = read_header(path, type)
+    tags = header.tags
+
+    return {
+        "path": path,
+        "type": type,
+        "duration": header.duration,
+        "artist": tags.get("artist"),
+        "album_artist": tags.get("album_artist"),
+        "album": tags.get("album"),
+        "title": tags.get("title"),
+        "genre": tags.get("genre") if type == "flac" else None, # ffprobe never reported mp3 genres
+        "track": parse_track(tags.get("track")),
+    }
+
+def probe(path: str, type: str) -> dict:
+    """
+    Fetch a track's info dict.
+
+    Headers are read directly when possible, only falling back to ffprobe if they couldn't be parsed.
+    Doesn't touch the audio device, so it's safe to call from any number of threads or processes at once.
+    """
+    try:
+        return read_info(path, type)
+    except (MetadataError, OSError):
+        pass
+
+    import pydub.utils # only needed for the odd file we can't parse
+    audio_info = pydub.utils.mediainfo(path)
+    # audio_info = TinyTag.get(path)
+    tags = audio_info.get("TAG", "???")
+
+    if type == "flac":
+        artist = tags.get("ARTIST", None)
+        album_artist = tags.get("album_artist")
+        album = tags.get("ALBUM", None)
+        title = tags.get("TITLE", None)
+        track = parse_track(tags.get("track", 0))
+        genre = tags.get("GENRE", None)
+    elif type == "mp3":
+        artist = tags.get("artist", None)
+        album_artist = tags.get("album_artist")
+        album = tags.get("album", None)
+        title = tags.get("title", None)
+        track = parse_track(tags.get("track", 0))
+        genre = None
+
+    duration = float(audio_info.get("duration", 0)) # should exist in all formats
+
+    return {"path": path, "type": type, "duration": duration, "artist": artist, "album_artist": album_artist, "album": album, "title": title, "genre": genre, "track": track}
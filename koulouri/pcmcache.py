@@ -0,0 +1,186 @@
+"""
+On-disk cache of decoded audio.
+
+Tracks are stored as WAV files named after their TID, the source file's mtime and their sample format,
+so a changed file is never served from the cache. The least recently played tracks are removed once the cache grows past its
+byte budget.
+"""
+import os
+import wave
+import logging
+from tempfile import mkstemp
+from dsp import WIDTHS
+
+DEFAULT_PATH = "pcmcache"
+DEFAULT_BUDGET = 1024 * 1024 * 1024 # 1 GiB
+
+class PCMCache:
+    """
+    Decoded-audio cache with a byte budget and LRU eviction.
+
+    A file's mtime is bumped every time it is used, so the oldest files are always the least recently
+    played ones. Writes go to a temp file that is only renamed into place once the whole track has been
+    decoded, so a half written track is never read back.
+    """
+    def __init__(self, path: str = DEFAULT_PATH, budget: int = DEFAULT_BUDGET):
+        self.path = path
+        self.budget = budget
+
+    def _file(self, tid: str, mtime: int, sample_format: str) -> str:
+        return os.path.join(self.path, f"{tid}-{mtime}.{sample_format}.wav")
+
+    def get(self, tid: str, mtime: int, sample_format: str = "s16") -> str | None:
+        """
+        Return the path of a cached track, or None if it isn't cached.
+        """
+        path = self._file(tid, mtime, sample_format)
+        try:
+            os.utime(path) # mark as recently used
+        except FileNotFoundError:
+            return None
+        return path
+
+    def writer(self, tid: str, mtime: int, rate: int, channels: int, sample_format: str = "s16"):
+        """
+        Start caching a track. Returns None if the cache is disabled or can't be written to.
+        """
+        if self.budget <= 0:
+            return None
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            return CacheWriter(self, self._file(tid, mtime, sample_format), rate, channels, WIDTHS[sample_format])
+        except OSError as e:
+            logging.warning(f"unable to write to the pcm cache: {e}")
+            return None
+
+    def evict(self):
+        """
+        Remove the least recently used tracks until the cache fits within its budget.
+        """
+        try:
+            with os.scandir(self.path) as entries:
+                files = [(_.stat().st_mtime_ns, _.stat().st_size, _.path) for _ in entries
+                         if _.is_file() and _.name.endswith(".wav")]
+        except FileNotFoundError:
+            return
+
+        total = sum(_[1] for _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.budget:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError: # already evicted
+                pass
+            except OSError: # still open on windows, try again next time
+                continue
+            total -= size
+
+    def clear(self):
+        """
+        Remove every cached track.
+        """
+        budget, self.budget = self.budget, 0
+        self.evict()
+        self.budget = budget
+
+class CacheWriter:
+    """
+    Writes a single track into the cache (see `PCMCache.writer`).
+
+    Nothing is visible in the cache until `commit` is called. `abort` throws the partial track away.
+    """
+    def __init__(self, cache: PCMCache, path: str, rate: int, channels: int, sample_width: int):
+        self.__cache = cache
+        self.__path = path
+
+        fd, self.__tmp = mkstemp(prefix="koulouri-pcm_", suffix=".tmp", dir=cache.path)
+        self.__file = os.fdopen(fd, "wb")
+        self.__wf = wave.open(self.__file, "wb")
+        self.__wf.setnchannels(channels)
+        self.__wf.setsampwidth(sample_width)
+        self.__wf.setframerate(rate)
+
+    def write(self, data):
+        self.__wf.writeframesraw(data)
+
+    def commit(self):
+        if self.__wf is None:
+            return
+        self.__wf.close() # fixes up the header sizes
+        self.__file.close()
+        self.__wf = None
+        os.replace(self.__tmp, self.__path)
+        self.__cache.evict()
+
+    def abort(self):
+        if self.__wf is None:
+            return
+        self.__wf.close()
+        self.__file.close()
+        self.__wf = None
+        os.remove(self.__tmp)
+
+class CachingSource:
+    """
+    Wraps a source, copying everything read from it into the cache.
+
+    The track is only committed if it was read from start to finish, and the decoder didn't give up early
+    (see `_complete`). Seeking would leave a hole in the cached audio, so it stops caching instead.
+    """
+    def __init__(self, source, writer: CacheWriter):
+        self.__source = source
+        self.__writer = writer
+        self.rate = source.rate
+        self.channels = source.channels
+        self.sample_format = source.sample_format
+        self.sample_width = source.sample_width
+        self.__frames = 0
+
+    def _complete(self) -> bool:
+        """
+        Whether the decoder exited cleanly and produced about as much audio as the track is long.
+        """
+        if not self.__source.succeeded():
+            return False
+        duration = getattr(self.__source, "duration", None)
+        if not duration:
+            return True
+        missing = duration * self.rate - self.__frames
+        return missing <= max(self.rate, duration * self.rate * 0.02) # tags can be off by a little
+
+    def read(self, frames: int) -> bytes:
+        data = self.__source.read(frames)
+        if self.__writer:
+            try:
+                if data:
+                    self.__writer.write(data)
+                    self.__frames += len(data) // (self.channels * self.sample_width)
+                elif self._complete(): # finished decoding
+                    self.__writer.commit()
+                    self.__writer = None
+                else:
+                    logging.warning("decoding ended early, not caching the track")
+                    self._abort()
+            except OSError as e: # most likely out of disk space
+                logging.warning(f"unable to write to the pcm cache: {e}")
+                self._abort()
+        return data
+
+    def seek(self, seconds: float) -> bool:
+        moved = self.__source.seek(seconds)
+        if moved:
+            self._abort()
+        return moved
+
+    def _abort(self):
+        if self.__writer:
+            try:
+                self.__writer.abort()
+            except OSError:
+                pass
+            self.__writer = None
+
+    def close(self):
+        self._abort()
+        self.__source.close()
@@ -4,7 +4,8 @@ import pydub.utils
 from pygame import mixer
 from pygame import error as pyerr
 from tempfile import NamedTemporaryFile
-import json
+import metadata
+import lyrics
 
 class Player:
     def __init__(self, rpc = None):
@@ -20,9 +21,9 @@ class Player:
         self.__active = False # loaded audio, ready to play
         self.__file = None
         self.__offset_time = 0 # visual offset
+        self.__length = 0
         
         # External
-        self.__lyrics = ""
         self.__rpc = rpc
 
         pass
@@ -44,7 +45,17 @@ class Player:
         self.__volume = new_vol
         self.mixer.set_volume(new_vol/100)
 
-    def play(self, path: str, input_format: str):
+    def queue_next(self, path: str | None, input_format: str | None = None, tid: str | None = None):
+        """
+        Gapless playback isn't supported by this backend, so hints are ignored.
+        """
+        pass
+
+    @property
+    def transitions(self) -> int:
+        return 0
+
+    def play(self, path: str, input_format: str, tid: str | None = None):
         """
         Load a file into memory and start playback.
 
@@ -83,10 +94,21 @@ class Player:
         self.__playing = True
         self.__active = True
         self.__offset_time = 0
+        self.__length = info["duration"] or 0
 
         return info
 
     def get_info(self, path: str, type: str):
+        """
+        Fetch a track's metadata.
+
+        Headers are read directly when possible, only falling back to ffprobe if they couldn't be parsed.
+        """
+        try:
+            return metadata.read_info(path, type)
+        except (metadata.MetadataError, OSError):
+            pass
+
         # fetch metadata
         audio_info = pydub.utils.mediainfo(path)
         # audio_info = TinyTag.get(path)
@@ -97,14 +119,14 @@ class Player:
             album_artist = tags.get("album_artist")
             album = tags.get("ALBUM", None)
             title = tags.get("TITLE", None)
-            track = int(tags.get("track", 0))
+            track = metadata.parse_track(tags.get("track", 0))
             genre = tags.get("GENRE", None)
         elif type == "mp3":
             artist = tags.get("artist", None)
             album_artist = tags.get("album_artist")
             album = tags.get("album", None)
             title = tags.get("title", None)
-            track = int(tags.get("track", 0))
+            track = metadata.parse_track(tags.get("track", 0))
             genre = None
 
         duration = float(audio_info.get("duration", 0)) # should exist in all formats            
@@ -124,7 +146,6 @@ class Player:
         if sys.platform == "win32" and self.__file: # manually delete the temp file on windows systems
             os.unlink(self.__file.name)
 
-        self.__lyrics = ""
         self.__file = None
         self.__playing = False
         self.__active = False
@@ -188,6 +209,18 @@ class Player:
         """
         return self.mixer.get_pos()/1000 + self.__offset_time
 
+    def get_remaining(self) -> float:
+        """
+        How much of the current track is left to play, in seconds.
+        """
+        return max(0, self.__length - self.get_time()) if self.__active else 0
+
+    def get_buffered(self) -> float:
+        """
+        The mixer handles its own buffering, so this is always 0.
+        """
+        return 0
+
     def is_playing(self):
         """
         Whether or not the player is currently playing.
@@ -202,108 +235,5 @@ class Player:
         """
         return self.__active
     
-    def fetch_lyrics(self, path: str):
-        lyric_file = path.split(".")[0]+".lrc"
-        
-        if not os.path.exists(lyric_file):
-            return ""
-
-        if self.__lyrics:
-            return self.__lyrics
-
-        with open(lyric_file, "r") as f:
-            lyrics = []
-            for line in f.read().split("\n"):
-                try:
-                    time_min = int(line[1:3])
-                    time_sec = int(line[4:6])
-                    time_mili = float(line[6:9])
-                    lyric = line[10:]
-
-                    lyrics.append({"lyric": lyric, "tmin": time_min, "tsec": time_sec, "tmil": time_mili})
-                except:
-                    pass
-            self.__lyrics = lyrics
-
-            return self.__lyrics
-
-class Data:
-    def __init__(self):
-        self.__path = "kdata.json"
-        self.__data = {}
-
-        if not os.path.exists(self.__path):
-            self.__data = {
-                "favorites": []
-            }
-            self.__sync()
-        else:
-            self.__data = self.__load()
-
-    def __sync(self):
-        """
-        Sync current memory data to disk.
-        """
-        with open(self.__path, "w") as f:
-            json.dump(self.__data, f)
-    def __load(self):
-        """
-        Load disk to memory.
-        """
-        with open(self.__path, "r") as f:
-            return json.load(f)
-
-    def add_favorite(self, tid: str):
-        """
-        Add a track to the user's favorites.
-
-        Returns False if the song is already a favorite.
-        """
-        favorites = self.__data.get("favorites", [])
-        if tid not in favorites:
-            self.__data["favorites"].append(tid)
-            self.__sync()
-            return True
-        else:
-            return False
-
-    def remove_favorite(self, tid: str):
-        """
-        Remove a track from the user's favorites.
-
-        Returns False if the track did not exist already.
-        """
-
-        favorites = self.__data.get("favorites", [])
-        if tid in favorites:
-            self.__data["favorites"].remove(tid)
-            self.__sync()
-            return True
-        else:
-            return False
-
-    def toggle_favorite(self, tid: str):
-        """
-        Helper function that automatically adds or removes a track to the user's
-        favorite.
-
-        Returns the current status of `is_favorite` after toggling.
-        """
-        is_favorite = not self.is_favorite(tid)
-
-        if is_favorite:
-            self.add_favorite(tid)
-        else:
-            self.remove_favorite(tid)
-
-        return self.is_favorite(tid)
-
-    def is_favorite(self, tid: str):
-        """
-        Fetch a favorite song by its TID, if it exists.
-        """
-        favorites = self.__data.get("favorites", [])
-        if tid in favorites:
-            return True
-        else:
-            return False
+    def fetch_lyrics(self, path: str) -> lyrics.Lyrics:
+        return lyrics.load(path)
@@ -1,39 +1,92 @@
-import pydub, pydub.utils, pyaudio, wave
+import pydub, pydub.utils, pyaudio
 import os, sys
-import threading, time
+import threading
 import logging
-import json
-from tempfile import NamedTemporaryFile
+import struct
+import metadata
+import lyrics
+from dsp import Gain, WIDTHS
+from decoder import BufferSource, FFmpegSource, probe_format
+from pcmcache import PCMCache, CachingSource, DEFAULT_BUDGET
+from ring import RingBuffer
+from tuning import BufferTuner
 
 logging.basicConfig(level=logging.DEBUG, filename="test.txt")
 
+PA_FORMATS = {"s16": pyaudio.paInt16, "s32": pyaudio.paInt32, "f32": pyaudio.paFloat32}
+
 class Player:
     """
     Alternate player backend using `pyaudio` instead of `pygame.mixer` to play audio.
 
-    May be more reliable than PyGame, due to the writer thread's direct control over the audio stream
-    allowing for per-chunk data analysis and manipulation, however, may use more CPU due to
-    math applied to the audio data (volume adjustment).
+    May be more reliable than PyGame, due to the direct control over the audio stream allowing for
+    per-chunk data analysis and manipulation. Volume adjustment is applied to whole chunks at once
+    (see `dsp.Gain`), and skipped entirely at 100%.
+
+    Audio is decoded ahead of time by a producer thread into a `ring.RingBuffer`, which PyAudio's stream
+    callback reads from. Pausing stops the stream entirely, and the producer sleeps until there's room
+    in the buffer, so neither side polls.
+
+    A single output stream is opened on the first call to `play` and reused for every track after it,
+    running at `rate` (the output device's default rate if not set). Tracks are resampled to it while
+    decoding. Call `exit` once the player is no longer needed.
+
+    With `hires` set, tracks are played in their own rate, channel count and bit depth instead, as long
+    as the output device supports them (see `_negotiate`). 24-bit audio is played as 32-bit. The stream
+    is only reopened when the format changes between tracks.
+
+    Buffer sizes adapt to underruns (see `tuning.BufferTuner`, which `buffering` is passed on to), and new
+    sizes are applied the next time a track is started.
+
+    Decoded tracks are kept in a `pcmcache.PCMCache` of up to `cache_size` bytes (0 to disable), so
+    replaying a recent track doesn't need FFmpeg at all.
     """
-    def __init__(self, rpc = None):
+    def __init__(self, rpc = None, streaming: bool = True, cache_size: int = DEFAULT_BUDGET, rate: int | None = None,
+                 hires: bool = False, buffering: dict | None = None):
 
         # Settings
         self.__volume = 100
+        self.streaming = streaming # decode through an ffmpeg pipe instead of converting the whole file first
+        self.hires = hires # play tracks in their native format
+        self.__rate = rate
+        self.__buffering = buffering or {}
 
         self.__playing = False # playing audio
         self.__paused = False
-        self.__file = None
-        self.__time = 0
-        self.__seek_to = 0
+        self.__wake = threading.Event() # wakes the producer thread up
+        self.__control = threading.Lock()
+        self.__drained = False # the producer has nothing left to write
+        self.__filling = False # the ring buffer hasn't been filled since the track started (or was seeked)
+        self.__complete = False # the callback has played everything
+        self.__source = None
+        self.__info = None
+        self.__next = None # the track hinted by `queue_next`
+        self.__next_lock = threading.Lock()
+        self.__transitions = 0
+        self.__marks = [] # (ring position, seconds into the track, new track info), see `_mark`
+        self.__clock_lock = threading.Lock()
+        self.__clock = (0, 0, 0.0) # (ring position, position after the last callback, when that buffer reaches the DAC)
+        self.__latency = 0.0 # reported by the stream
+        self.__seek_to = None
         self.__offset_time = 0 # visual offset
 
-        self.__lyrics = ""
         self.__rpc = rpc
 
         self.__audio = pyaudio.PyAudio()
         self.__audio_stream = None
         self.__audio_thread = None
+        self.__format = None # (rate, channels, sample format) of the open stream
+        self.__device = None # output device info
         self.__audio_samprate = 44100
+        self.__channels = 2
+        self.__sample_format = "s16"
+        self.__frame_bytes = 4 # 16-bit stereo
+        self.__frames = 1024 # frames per buffer of the open stream, also decoded at a time
+        self.__tuner = None # created once we know the output device
+        self.__ring = RingBuffer(8 * self.__frames * self.__frame_bytes)
+        self.__out = bytearray() # the callback's output buffer
+        self.__gain = Gain()
+        self.__cache = PCMCache(budget=cache_size) if cache_size > 0 else None
 
     @property
     def volume(self) -> int:
@@ -51,119 +104,221 @@ class Player:
         
         self.__volume = new_vol
 
-    def _write_audio(self, wf: wave.Wave_read):
-        """
-        Write audio into the stream.
-
-        Automatically adjusts the volume of the audio before writing it into the stream.
-        """
-        bytes_per_sample = wf.getsampwidth()
-        channels = wf.getnchannels()
-        self.__time = 0 # reset timer
-
-        data = wf.readframes(1024)
-
-        while self.__playing:
-            if self.__seek_to:
-                # Calculate the byte position from the time in seconds
-                byte_position = int(self.__seek_to * bytes_per_sample * channels * self.__audio_samprate)
-                
-                if byte_position < 0: # can't go under 0!
-                    pass
-                elif byte_position > os.path.getsize(self.__file.name): # don't go over!
-                    pass
-                else:
-                    # Seek the file to the calculated byte position
-                    # the wave module expects frame position, so some extra math is needed.
-                    wf.setpos(byte_position // (bytes_per_sample * channels))
-                    
-                    # Update the time to reflect the new position
-                    self.__time = self.__seek_to
-                self.__seek_to = 0
-
-            if self.__paused:
-                time.sleep(0.001)
+    def _produce(self, source):
+        """
+        Decode audio into the ring buffer, ahead of the stream callback (see `_callback`).
+
+        Sleeps whenever the buffer is full (or playback is paused), until it is woken up by the callback,
+        `resume`, `seek` or `stop`.
+        """
+        data = source.read(self.__frames)
+        previous = None # the track before `source`, kept open until the callback has finished playing it
+
+        while self.__playing and not self.__complete:
+            self.__wake.clear()
+
+            with self.__control:
+                seek_to, self.__seek_to = self.__seek_to, None
+            behind = moved = False
+            if previous:
+                with self.__clock_lock: # so the callback can't be found to reach `source` halfway through
+                    self._catch_up()
+                    behind = len(self.__marks) > 1 # it's still playing the end of `previous`
+                    if behind and seek_to is not None: # which is what the seek is meant for
+                        moved = previous.seek(seek_to)
+                        if moved:
+                            del self.__marks[1:] # `source` is thrown away, it's prepared again once it's hinted
+                if moved:
+                    source.close()
+                    source = self.__source = previous
+                elif not behind:
+                    previous.close()
+                if moved or not behind:
+                    previous = None
+            if seek_to is not None and (moved or not behind and source.seek(seek_to)): # sources ignore positions that are out of range
+                self._mark(self.__ring.clear(), seek_to)
+                self.__filling = True
+                data = source.read(self.__frames)
+                self.__drained = False
+
+            if not data and not self.__paused:
+                nxt = self._take_next()
+                if nxt: # continue straight into the next track on the same stream
+                    if previous:
+                        previous.close()
+                    previous, source = source, nxt["source"]
+                    self.__source = source
+                    self._mark(self.__ring.written, 0, nxt["info"])
+                    if self.__drained: # the hint came late, the ring may be close to running dry
+                        self.__filling = True
+                        self.__drained = False
+                    data = source.read(self.__frames)
+                    continue
+
+                # the callback finishes the stream once it has played the rest, unless a hint is ready by then
+                self.__drained = True
+
+            if self.__paused or self.__drained or self.__ring.free() < len(data):
+                if not self.__paused and not self.__drained: # full
+                    self.__filling = False
+                    self.__tuner.update()
+                self.__wake.wait()
                 continue
 
-            adjusted_data = bytearray()
-
-            if data:
-                # adjust volume
-                for i in range(0, len(data), 2):  # Process two bytes at a time (16-bit PCM)
-                    # Read two bytes (16-bit audio)
-                    sample = int.from_bytes(data[i:i+2], byteorder='little', signed=True)
-                    
-                    # Adjust the volume by scaling the sample
-                    adjusted_sample = int(sample * (self.__volume/100))
-
-                    # Clip to valid 16-bit range and append to the adjusted audio
-                    adjusted_sample = max(min(adjusted_sample, 32767), -32768)
-                    adjusted_data.extend(adjusted_sample.to_bytes(2, byteorder='little', signed=True))
-
-                self.__time += len(data) / (bytes_per_sample * channels * self.__audio_samprate) # update timer
-                self.__audio_stream.write(bytes(adjusted_data))
-                data = wf.readframes(1024)
-            else:
-                try:
-                    self.stop(False)
-                except RuntimeError: # can't join ourself
-                    pass
-                break
+            self.__ring.write(data)
+            data = source.read(self.__frames)
 
+        if previous:
+            previous.close()
+        if self.__complete:
+            try:
+                self.stop(False)
+            except RuntimeError: # can't join ourself
+                pass
 
-    def get_info(self, path: str, type: str):
-        # fetch metadata
-        audio_info = pydub.utils.mediainfo(path)
-        # audio_info = TinyTag.get(path)
-        tags = audio_info.get("TAG", "???")
-
-        if type == "flac":
-            artist = tags.get("ARTIST", None)
-            album_artist = tags.get("album_artist")
-            album = tags.get("ALBUM", None)
-            title = tags.get("TITLE", None)
-            track = int(tags.get("track", 0))
-            genre = tags.get("GENRE", None)
-        elif type == "mp3":
-            artist = tags.get("artist", None)
-            album_artist = tags.get("album_artist")
-            album = tags.get("album", None)
-            title = tags.get("title", None)
-            track = int(tags.get("track", 0))
-            genre = None
-
-        duration = float(audio_info.get("duration", 0)) # should exist in all formats            
-
-        return {"path": path, "type": type, "duration": duration, "artist": artist, "album_artist": album_artist, "album": album, "title": title, "genre": genre, "track": track}
-    
-    def play(self, path: str, input_format: str):
+    def _callback(self, in_data, frame_count: int, time_info: dict, status: int):
+        """
+        PyAudio stream callback. Runs on the audio thread, so it only copies out of the ring buffer.
         """
-        Load a file into memory and start playback.
+        size = frame_count * self.__frame_bytes
+        if len(self.__out) != size:
+            self.__out = bytearray(size)
+
+        if status & pyaudio.paOutputUnderflow:
+            self.__tuner.underflow()
+
+        flag = pyaudio.paContinue
+        n = self.__ring.read_into(self.__out)
+        if n < size:
+            self.__out[n:] = bytes(size - n) # ran dry, fill the rest with silence
+            if self.__drained and not self.__ring.available():
+                self.__complete = True
+                flag = pyaudio.paComplete
+            elif not self.__filling and not self.__drained: # the producer couldn't keep up
+                self.__tuner.starved()
+
+        # the first frame of this buffer is heard at `dac_time`, which not every host api reports
+        dac_time = time_info.get("output_buffer_dac_time") or 0
+        if not dac_time:
+            dac_time = (time_info.get("current_time") or 0) + self.__latency
+        self.__clock = (self.__ring.consumed - n, self.__ring.consumed, dac_time) # replaced all at once
+
+        self.__wake.set() # there's room for more now
+        return (bytes(self.__gain.apply(self.__out, self.__volume, self.__sample_format)), flag)
+
+    def _mark(self, position: int, start: float, info: dict | None = None):
+        """
+        Record that the audio written at `position` in the ring buffer is `start` seconds into a track,
+        and that it is a new track if `info` is supplied.
 
-        Automatically converts the input file into a wav, storing it temporarily inside of
-        the system's temp folder via `tempfile`.
+        Marks take effect once the callback has played up to them (see `_position`), except for seeks,
+        which throw away everything before them.
         """
-        tmp = NamedTemporaryFile(prefix="koulouri-conv_")
+        with self.__clock_lock:
+            self.__marks.append((position, start, info))
+            if info is None:
+                self._advance(len(self.__marks)-1)
 
-        if sys.platform == "win32":
-            tmp.delete = False
-            tmp.close()
+    def _advance(self, count: int):
+        """
+        Drop the first `count` marks. Must hold `__clock_lock`.
+        """
+        for _ in range(count):
+            self.__marks.pop(0)
+            info = self.__marks[0][2]
+            if info is not None: # the callback has reached the next track
+                self._now_playing(info)
+                self.__transitions += 1
+
+    def _played(self) -> int:
+        """
+        How much of the ring buffer the output device has actually played, in bytes.
 
-        self.__file = tmp
+        Counts whole frames handed to the callback, then accounts for the ones that are still waiting in
+        the device's buffer by comparing the stream's clock with when the last buffer reaches the DAC.
+        """
+        start, end, dac_time = self.__clock
+        if not self.__audio_stream or not self.__audio_stream.is_active(): # stopping plays out the device's buffer
+            return end
+        if not dac_time:
+            return start
+        heard = (self.__audio_stream.get_time() - dac_time) * self.__audio_samprate
+        return min(end, start + max(0, int(heard)) * self.__frame_bytes)
+
+    def _catch_up(self) -> int:
+        """
+        Drop the marks the callback has played past, returning how much it played (see `_played`). Must
+        hold `__clock_lock`.
+        """
+        played = self._played()
+        reached = 0
+        while reached+1 < len(self.__marks) and self.__marks[reached+1][0] <= played:
+            reached += 1
+        self._advance(reached)
+        return played
+
+    def _position(self) -> float:
+        """
+        How far into the current track the output device has played, in seconds.
+        """
+        with self.__clock_lock:
+            if not self.__marks:
+                return 0
+            played = self._catch_up()
+            position, start, _ = self.__marks[0]
+        return start + max(0, played - position) / (self.__frame_bytes * self.__audio_samprate)
 
-        audio = pydub.AudioSegment.from_file(path, input_format).set_channels(2).set_sample_width(2)
-        self.__audio_samprate = audio.frame_rate
-        info = self.get_info(path, input_format)
+    def get_info(self, path: str, type: str):
+        """
+        Fetch a track's metadata (see `metadata.probe`).
+        """
+        return metadata.probe(path, type)
+    
+    def _convert(self, path: str, input_format: str, format: tuple) -> BufferSource:
+        """
+        Convert the entire input file into PCM, kept in memory.
+        """
+        rate, channels, sample_format = format
+        audio = pydub.AudioSegment.from_file(path, input_format)
+        audio = audio.set_channels(channels).set_sample_width(WIDTHS[sample_format]).set_frame_rate(rate)
+        return BufferSource(audio.raw_data, rate, channels, sample_format)
 
-        audio.export(self.__file.name, "wav")
+    def _open_source(self, path: str, input_format: str, info: dict, format: tuple, tid: str | None = None):
+        """
+        Open a PCM source for a file in the given output `format` (see `play`), reading from the cache
+        when possible.
+        """
+        rate, channels, sample_format = format
+        mtime = None
+        if self.__cache and tid:
+            mtime = os.stat(path).st_mtime_ns
+            cached = self.__cache.get(tid, mtime, sample_format)
+            if cached:
+                try:
+                    source = BufferSource.from_wav(cached, sample_format) # memory-mapped, so nothing is read until it's played
+                    if self._fits(source, format):
+                        return source
+                    source.close() # cached for a different output rate
+                    mtime = None
+                except (OSError, ValueError, struct.error): # damaged, decode it again
+                    logging.warning(f"ignoring damaged cache file '{cached}'")
+
+        if self.streaming:
+            source = FFmpegSource(path, rate, channels, info["duration"], sample_format=sample_format)
+        else:
+            source = self._convert(path, input_format, format)
 
-        wf = wave.open(self.__file.name, "rb") # we shouldn't be reading headers
+        if mtime is not None: # cache it as it's decoded
+            writer = self.__cache.writer(tid, mtime, rate, channels, sample_format)
+            if writer:
+                source = CachingSource(source, writer)
+        return source
 
-        self.__audio_stream = self.__audio.open(format=pyaudio.paInt16,
-                channels=wf.getnchannels(),
-                rate=wf.getframerate(), # adapting early may avoid us headaches
-                output=True,
-                frames_per_buffer=1024)
+    def _now_playing(self, info: dict):
+        """
+        Update everything that depends on the current track.
+        """
+        self.__info = info
 
         if self.__rpc: # update RPC stats
             if not self.__rpc.is_alive():
@@ -173,169 +328,289 @@ class Player:
             self.__rpc.artist = info["artist"]
             self.__rpc.album = info["album"]
 
-        self.__playing = True
+    def _fits(self, source, format: tuple) -> bool:
+        """
+        Whether or not a source is in the given (rate, channels, sample format).
+        """
+        return (source.rate, source.channels, source.sample_format) == format
 
-        self.__audio_thread = threading.Thread(target=self._write_audio, args=(wf,))
-        self.__audio_thread.start()
-        # self.__audio_stream.stop_stream()
-        # self.__audio_stream.close()
+    def _supported(self, rate: int, channels: int, sample_format: str) -> bool:
+        try:
+            return self.__audio.is_format_supported(rate, output_device=self.__device["index"],
+                                                    output_channels=channels, output_format=PA_FORMATS[sample_format])
+        except ValueError: # raised instead of returning False
+            return False
 
-        return info
+    def _negotiate(self, path: str, input_format: str) -> tuple[int, int, str]:
+        """
+        Pick the (rate, channels, sample format) to play a track in.
 
-    def stop(self, join: bool = True) -> None:
-        self.__playing = False
-        if self.__audio_thread and join:
-            self.__audio_thread.join() # wait for the writer to stop writing
+        Without `hires`, that's always 16-bit stereo at `rate`. Otherwise, the track's own format is used as
+        far as the output device supports it, falling back to its default rate, stereo, and 16-bit.
+        """
+        self.__device = self.__device or self.__audio.get_default_output_device_info()
+        default_rate = self.__rate or int(self.__device["defaultSampleRate"])
+        if not self.hires:
+            return (default_rate, 2, "s16")
+
+        try:
+            rate, channels, bits = probe_format(path, input_format)
+        except Exception:
+            logging.exception(f"unable to probe the format of '{path}'")
+            return (default_rate, 2, "s16")
+
+        if bits <= 16:
+            sample_formats = ["s16"]
+        elif self.streaming:
+            sample_formats = ["s32", "f32", "s16"]
+        else: # pydub can't produce floats
+            sample_formats = ["s32", "s16"]
+
+        for channels in dict.fromkeys([channels, 2]):
+            for sample_format in sample_formats:
+                for rate in dict.fromkeys([rate, default_rate]):
+                    if self._supported(rate, channels, sample_format):
+                        return (rate, channels, sample_format)
+        return (default_rate, 2, "s16")
+
+    def _open_stream(self, format: tuple):
+        """
+        Open the output stream in a given (rate, channels, sample format) with the tuner's buffer sizes, unless
+        it already is. It is left stopped.
+        """
+        if not self.__tuner:
+            self.__device = self.__device or self.__audio.get_default_output_device_info()
+            self.__tuner = BufferTuner(self.__device["name"], **self.__buffering)
 
+        if self.__audio_stream and self.__format == format and self.__frames == self.__tuner.frames \
+                and self.__ring.size == self.__tuner.chunks * self.__frames * self.__frame_bytes:
+            return
         if self.__audio_stream:
-            self.__audio_stream.stop_stream()
-            # self.__audio_stream.close()
+            self.__audio_stream.close()
+            self.__audio_stream = None
+
+        rate, channels, sample_format = format
+        self.__audio_samprate = rate
+        self.__channels = channels
+        self.__sample_format = sample_format
+        self.__frame_bytes = channels * WIDTHS[sample_format]
+        self.__frames = self.__tuner.frames
+        if self.__ring.size != self.__tuner.chunks * self.__frames * self.__frame_bytes:
+            self.__ring = RingBuffer(self.__tuner.chunks * self.__frames * self.__frame_bytes)
+
+        self.__audio_stream = self.__audio.open(format=PA_FORMATS[sample_format],
+                channels=channels,
+                rate=rate,
+                output=True,
+                frames_per_buffer=self.__frames,
+                stream_callback=self._callback,
+                start=False)
+        self.__latency = self.__audio_stream.get_output_latency()
+        self.__format = format
 
-        if self.__file and not self.__file.closed: # ensure temp files are closed properly
-            self.__file.close()
+    def play(self, path: str, input_format: str, tid: str | None = None):
+        """
+        Load a file and start playback.
 
-        if sys.platform == "win32" and self.__file: # manually delete the temp file on windows systems
-            os.unlink(self.__file.name)
+        When `streaming` is set, audio is decoded through an ffmpeg pipe while it plays, so playback starts
+        as soon as the first chunk is ready. Otherwise, the whole file is decoded into memory first (see `_convert`).
 
-        self.__lyrics = ""
-        self.__file = None
-        self.__active = False
+        Tracks are only cached if their `tid` is supplied.
+        """
+        self.stop() # the previous producer may still be finishing up
+        info = self.get_info(path, input_format)
+        format = self._negotiate(path, input_format)
 
-    def pause(self):
-        self.__paused = True
+        source = self.__source = self._open_source(path, input_format, info, format, tid)
+        self._open_stream(format)
 
-    def resume(self):
+        self.__ring.reset() # the stream is stopped, so the callback isn't reading from it
+        self.__clock = (0, 0, 0.0)
+        self.__ring.write(source.read(self.__frames)) # so the stream doesn't start off empty
+        self.__marks = [(0, 0, info)]
         self.__paused = False
+        self.__drained = False
+        self.__filling = True
+        self.__complete = False
+        self.__seek_to = None
 
-    def seek(self, to: int):
-        self.__seek_to = to
-    
-    def get_time(self) -> float:
-        return self.__time
-    
-    def fetch_lyrics(self, path: str):
-        lyric_file = path.split(".")[0]+".lrc"
-        
-        if not os.path.exists(lyric_file):
-            return ""
+        self._now_playing(info)
+        self.__playing = True
 
-        if self.__lyrics:
-            return self.__lyrics
+        self.__audio_stream.start_stream()
 
-        with open(lyric_file, "r") as f:
-            lyrics = []
-            for line in f.read().split("\n"):
-                try:
-                    time_min = int(line[1:3])
-                    time_sec = int(line[4:6])
-                    time_mili = float(line[6:9])
-                    lyric = line[10:]
+        self.__audio_thread = threading.Thread(target=self._produce, args=(source,))
+        self.__audio_thread.start()
 
-                    lyrics.append({"lyric": lyric, "tmin": time_min, "tsec": time_sec, "tmil": time_mili})
-                except:
-                    pass
-            self.__lyrics = lyrics
+        return info
 
-            return self.__lyrics
+    def queue_next(self, path: str | None, input_format: str | None = None, tid: str | None = None):
+        """
+        Hint which track will play after the current one, or clear the hint if `path` is None.
 
-    def is_playing(self) -> tuple[bool, bool]:
+        The track is prepared in the background, and once the current track ends, the producer thread
+        continues straight into it on the same stream, without a gap. Frontends can tell this happened
+        by watching `transitions`. Hinting a different track replaces the previous hint.
         """
-        Whether or not the player is playing audio.
+        if path is None:
+            self._discard_next()
+            return
+
+        with self.__next_lock:
+            old = self.__next
+            if old and old["path"] == path:
+                return
+            self.__next = nxt = {"path": path, "format": input_format, "info": None, "tid": tid, "source": None,
+                                 "ready": threading.Event()}
+            self._close_next(old)
+
+        threading.Thread(target=self._prepare_next, args=(nxt,), daemon=True).start()
+
+    def _prepare_next(self, nxt: dict):
+        try:
+            nxt["info"] = self.get_info(nxt["path"], nxt["format"])
+            format = self._negotiate(nxt["path"], nxt["format"])
+            nxt["source"] = self._open_source(nxt["path"], nxt["format"], nxt["info"], format, nxt["tid"])
+        except Exception:
+            logging.exception(f"unable to prepare '{nxt['path']}'")
+
+        with self.__next_lock:
+            nxt["ready"].set()
+            if self.__next is not nxt: # replaced while we were preparing it
+                self._close_next(nxt)
+        self.__wake.set() # the producer may already be waiting for it
+
+    def _close_next(self, nxt: dict | None):
+        """
+        Close a prepared track. Must hold `__next_lock`, so that only one thread closes it.
+        """
+        if nxt and nxt["ready"].is_set() and nxt["source"]:
+            nxt["source"].close()
+            nxt["source"] = None
 
-        Returns a tuple of the `Player` status and the `pyaudio.Stream` status.
+    def _discard_next(self):
+        with self.__next_lock:
+            self._close_next(self.__next)
+            self.__next = None
+
+    def _take_next(self) -> dict | None:
         """
-        if self.__audio_stream:
-            act = self.__audio_stream.is_active()
-        else:
-            act = False
+        Take the hinted track once the current one has ended, if it can be played on the same stream.
 
-        return (self.__playing, act)
+        Never waits for a hint that is still being prepared, the producer checks again once it's ready. A
+        hint that can't be played on the same stream is left alone, for the frontend to play normally.
+        """
+        with self.__next_lock:
+            nxt = self.__next
+            if not nxt or not nxt["ready"].is_set() or not nxt["source"] or not self._fits(nxt["source"], self.__format):
+                return None
+            self.__next = None
+        return nxt
 
-    def is_active(self) -> bool: # compat?
-        if self.__audio_thread:
-            return self.__audio_thread.is_alive()
-        else:
-            return False
+    @property
+    def transitions(self) -> int:
+        """
+        How many times playback has continued into a hinted track (see `queue_next`).
+        """
+        self._position() # catch up with the callback
+        return self.__transitions
+
+    @property
+    def current(self) -> dict | None:
+        """
+        The info of the track that is currently playing.
+        """
+        self._position()
+        return self.__info
+
+    def stop(self, join: bool = True) -> None:
+        self.__playing = False
+        self.__wake.set()
+        if self.__audio_thread and join:
+            self.__audio_thread.join() # wait for the producer to stop writing
 
+        if self.__audio_stream: # kept open for the next track
+            self.__audio_stream.stop_stream()
 
-class Data:
-    def __init__(self):
-        self.__path = "kdata.json"
-        self.__data = {}
+        if self.__source: # stops the decoder and removes temp files, if any
+            self.__source.close()
+            self.__source = None
 
-        if not os.path.exists(self.__path):
-            self.__data = {
-                "favorites": []
-            }
-            self.__sync()
-        else:
-            self.__data = self.__load()
+        if join: # the writer stops itself at the end of a track, which shouldn't cancel the next one
+            self._discard_next()
 
-    def __sync(self):
+        self.__active = False
+
+    def exit(self):
         """
-        Sync current memory data to disk.
+        Stop playback and release the output device. The player can't be used afterwards.
         """
-        with open(self.__path, "w") as f:
-            json.dump(self.__data, f)
-    def __load(self):
+        self.stop()
+        if self.__audio_stream:
+            self.__audio_stream.close()
+            self.__audio_stream = None
+        self.__audio.terminate()
+
+    def pause(self):
+        with self.__control:
+            self.__paused = True
+            if self.__audio_stream:
+                self.__audio_stream.stop_stream() # no callbacks at all while paused
+
+    def resume(self):
+        with self.__control:
+            self.__paused = False
+            if self.__audio_stream and not self.__complete:
+                self.__audio_stream.start_stream()
+        self.__wake.set()
+
+    def seek(self, to: int):
+        with self.__control:
+            self.__seek_to = to
+        self.__wake.set()
+    
+    def get_time(self) -> float:
         """
-        Load disk to memory.
+        How far into the current track playback is, in seconds, counting only what the output device has
+        actually played.
         """
-        with open(self.__path, "r") as f:
-            return json.load(f)
+        return self._position()
 
-    def add_favorite(self, tid: str):
+    def get_remaining(self) -> float:
         """
-        Add a track to the user's favorites.
-
-        Returns False if the song is already a favorite.
+        How much of the current track is left to play, in seconds.
         """
-        favorites = self.__data.get("favorites", [])
-        if tid not in favorites:
-            self.__data["favorites"].append(tid)
-            self.__sync()
-            return True
-        else:
-            return False
+        info = self.current
+        if not info or not info["duration"]:
+            return 0
+        return max(0, info["duration"] - self._position())
 
-    def remove_favorite(self, tid: str):
+    def get_buffered(self) -> float:
         """
-        Remove a track from the user's favorites.
-
-        Returns False if the track did not exist already.
+        How much audio has been decoded ahead of what the output device has played, in seconds.
         """
+        with self.__clock_lock:
+            return max(0, self.__ring.written - self._played()) / (self.__frame_bytes * self.__audio_samprate)
+    
+    def fetch_lyrics(self, path: str) -> lyrics.Lyrics:
+        return lyrics.load(path)
 
-        favorites = self.__data.get("favorites", [])
-        if tid in favorites:
-            self.__data["favorites"].remove(tid)
-            self.__sync()
-            return True
-        else:
-            return False
-
-    def toggle_favorite(self, tid: str):
+    def is_playing(self) -> tuple[bool, bool]:
         """
-        Helper function that automatically adds or removes a track to the user's
-        favorite.
+        Whether or not the player is playing audio.
 
-        Returns the current status of `is_favorite` after toggling.
+        Returns a tuple of the `Player` status and the `pyaudio.Stream` status.
         """
-        is_favorite = not self.is_favorite(tid)
-
-        if is_favorite:
-            self.add_favorite(tid)
+        if self.__audio_stream:
+            act = self.__audio_stream.is_active()
         else:
-            self.remove_favorite(tid)
+            act = False
 
-        return self.is_favorite(tid)
+        return (self.__playing, act)
 
-    def is_favorite(self, tid: str):
-        """
-        Fetch a favorite song by its TID, if it exists.
-        """
-        favorites = self.__data.get("favorites", [])
-        if tid in favorites:
-            return True
+    def is_active(self) -> bool: # compat?
+        if self.__audio_thread:
+            return self.__audio_thread.is_alive()
         else:
             return False
 
@@ -0,0 +1,325 @@
+"""
+The play queue.
+
+Entries are kept in blocks of a few hundred, so inserting, removing or moving an entry anywhere only
+shuffles one block around instead of the whole queue, even with the entire library queued up.
+"""
+import json
+import random
+import logging
+import threading
+from data import WriteBehind
+
+BLOCK_SIZE = 512 # entries per block
+QUEUE_PATH = "kqueue.json"
+
+class _Block:
+    # blocks are compared by identity (see `index_of`), never by their contents
+    __slots__ = ("ids",)
+
+    def __init__(self, ids: list):
+        self.ids = ids
+
+class PlayQueue:
+    """
+    An ordered list of songs, where each entry has an id that never changes or gets reused.
+
+    The current entry is tracked by its id, so inserting, removing and moving entries around it never
+    changes what's playing. `position` is its index, or -1 before the first entry. Removing the current
+    entry makes the one before it current, so the one after it plays next.
+
+    Given a `path`, the queue is saved there shortly after every change (see `data.WriteBehind`) and can be
+    brought back with `load`.
+    """
+    def __init__(self, songs = (), path: str | None = None):
+        self.__blocks = [_Block([])]
+        self.__songs = {} # entry id -> song
+        self.__block_of = {} # entry id -> _Block
+        self.__next_id = 0
+        self.__current = None # entry id
+        self.__lock = threading.RLock() # the GUI changes the queue from two threads
+        self.version = 0 # increases on every change, so views know when to redraw
+        self.resume = None # entry id of the track that was playing when the queue was saved, see `load`
+        self.__saver = WriteBehind(path, self._snapshot) if path else None
+
+        self.extend(songs)
+
+    @classmethod
+    def load(cls, songs: dict, path: str = QUEUE_PATH):
+        """
+        Restore a queue saved to `path`, looking its tracks up in `songs` (TID -> song). Tracks that are no
+        longer in the library are skipped.
+
+        `resume` is set to the entry that was playing, for frontends to play it again. If that track is gone,
+        it is None and the entry before it is current, so playback carries on with the one after it.
+        """
+        queue = cls()
+        try:
+            with open(path, "r") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            saved = {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"unable to restore the queue from '{path}': {e}")
+            saved = {}
+
+        tids = saved.get("tracks", [])
+        position = saved.get("position", -1)
+        found = [songs.get(_) for _ in tids]
+        queue.extend(_ for _ in found if _ is not None)
+        playing = 0 <= position < len(found) and found[position] is not None
+        if 0 <= position < len(found):
+            position -= found[:position+1].count(None) # the current track counts too, so the one after it plays next
+        queue.position = position
+        if playing:
+            queue.resume = queue.current_id
+        queue.__saver = WriteBehind(path, queue._snapshot) # only now, restoring isn't a change worth saving
+        return queue
+
+    def _snapshot(self) -> dict:
+        with self.__lock:
+            return {"position": self.position, "tracks": [_["id"] for _ in self]}
+
+    def _changed(self):
+        self.version += 1
+        if self.__saver:
+            self.__saver.changed()
+
+    def flush(self):
+        """
+        Save the queue now, if it has a path and anything changed.
+        """
+        if self.__saver:
+            self.__saver.flush()
+
+    def _locate(self, i: int) -> tuple[int, int]:
+        """
+        Find the (block, offset) of index `i`. `i == len(self)` is the end of the last block.
+        """
+        for b, block in enumerate(self.__blocks):
+            if i <= len(block.ids) and (i < len(block.ids) or b == len(self.__blocks)-1):
+                return b, i
+            i -= len(block.ids)
+        raise IndexError("queue index out of range")
+
+    def _index(self, i: int, end: bool = False) -> int:
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n + end:
+            raise IndexError("queue index out of range")
+        return i
+
+    def _insert_ids(self, i: int, ids: list):
+        """
+        Put existing entries at index `i`. Entries after them move to new blocks if theirs is full.
+        """
+        b, offset = self._locate(i)
+        block = self.__blocks[b]
+        tail = block.ids[offset:]
+        del block.ids[offset:]
+        ids = ids + tail
+
+        room = BLOCK_SIZE - len(block.ids)
+        block.ids.extend(ids[:room])
+        for id in ids[:room]:
+            self.__block_of[id] = block
+
+        new = []
+        for start in range(max(room, 0), len(ids), BLOCK_SIZE):
+            new.append(_Block(ids[start:start+BLOCK_SIZE]))
+            for id in new[-1].ids:
+                self.__block_of[id] = new[-1]
+        self.__blocks[b+1:b+1] = new
+
+    def _take_id(self, i: int) -> int:
+        """
+        Take the entry at index `i` out of its block, leaving its song in place.
+        """
+        b, offset = self._locate(i)
+        block = self.__blocks[b]
+        id = block.ids.pop(offset)
+        del self.__block_of[id]
+
+        if len(block.ids) < BLOCK_SIZE // 4 and len(self.__blocks) > 1: # merge small blocks into a neighbour
+            n = b-1 if b > 0 else b+1
+            neighbour = self.__blocks[n]
+            if len(neighbour.ids) + len(block.ids) <= BLOCK_SIZE:
+                if n < b:
+                    neighbour.ids.extend(block.ids)
+                else:
+                    neighbour.ids[:0] = block.ids
+                for _ in block.ids:
+                    self.__block_of[_] = neighbour
+                del self.__blocks[b]
+        return id
+
+    def __len__(self) -> int:
+        return len(self.__songs)
+
+    def __iter__(self):
+        for block in list(self.__blocks):
+            for id in list(block.ids):
+                yield self.__songs[id]
+
+    def __getitem__(self, i):
+        with self.__lock:
+            if isinstance(i, slice):
+                start, stop, step = i.indices(len(self))
+                if step != 1:
+                    return [self[_] for _ in range(start, stop, step)]
+                songs = []
+                if start >= stop:
+                    return songs
+                b, offset = self._locate(start)
+                for block in self.__blocks[b:]:
+                    for id in block.ids[offset:offset + stop - start - len(songs)]:
+                        songs.append(self.__songs[id])
+                    offset = 0
+                    if len(songs) >= stop - start:
+                        break
+                return songs
+
+            b, offset = self._locate(self._index(i))
+            return self.__songs[self.__blocks[b].ids[offset]]
+
+    def __setitem__(self, i: int, song: dict):
+        """
+        Replace the song of an entry, keeping the entry (and its id).
+        """
+        with self.__lock:
+            self.__songs[self.entry_id(i)] = song
+            self._changed()
+
+    def entry_id(self, i: int) -> int:
+        """
+        The id of the entry at index `i`.
+        """
+        with self.__lock:
+            b, offset = self._locate(self._index(i))
+            return self.__blocks[b].ids[offset]
+
+    def index_of(self, id: int) -> int:
+        """
+        The current index of an entry.
+        """
+        with self.__lock:
+            block = self.__block_of[id]
+            i = 0
+            for _ in self.__blocks:
+                if _ is block:
+                    return i + block.ids.index(id)
+                i += len(_.ids)
+
+    def insert(self, i: int, songs) -> list:
+        """
+        Insert one or more songs before index `i`, returning the new entries' ids.
+        """
+        if isinstance(songs, dict):
+            songs = [songs]
+        with self.__lock:
+            i = self._index(i, end=True) if i < len(self) else len(self)
+            ids = list(range(self.__next_id, self.__next_id + len(songs)))
+            self.__next_id += len(songs)
+            self.__songs.update(zip(ids, songs))
+            self._insert_ids(i, ids)
+            self._changed()
+            return ids
+
+    def append(self, song: dict) -> int:
+        return self.insert(len(self), song)[0]
+
+    def extend(self, songs) -> list:
+        return self.insert(len(self), list(songs))
+
+    def pop(self, i: int = -1) -> dict:
+        """
+        Remove the entry at index `i`, returning its song.
+        """
+        with self.__lock:
+            i = self._index(i)
+            id = self.entry_id(i)
+            if id == self.__current:
+                self.__current = self.entry_id(i-1) if i > 0 else None
+            self._take_id(i)
+            self._changed()
+            return self.__songs.pop(id)
+
+    def remove(self, id: int) -> dict:
+        """
+        Remove an entry by its id, returning its song.
+        """
+        with self.__lock:
+            return self.pop(self.index_of(id))
+
+    def move(self, src: int, dst: int):
+        """
+        Move the entry at index `src` so that it ends up at index `dst`.
+        """
+        with self.__lock:
+            src, dst = self._index(src), self._index(dst)
+            if src == dst:
+                return
+            self._insert_ids(dst, [self._take_id(src)])
+            self._changed()
+
+    def clear(self):
+        with self.__lock:
+            self.__blocks = [_Block([])]
+            self.__songs = {}
+            self.__block_of = {}
+            self.__current = None
+            self._changed()
+
+    def shuffle(self, start: int | None = None):
+        """
+        Shuffle every entry from index `start` on, which by default are the ones after the current entry.
+
+        Only the entry ids are reordered, the entries themselves stay as they are.
+        """
+        with self.__lock:
+            start = self.position + 1 if start is None else self._index(start, end=True)
+            ids = [id for block in self.__blocks for id in block.ids]
+            rest = ids[start:]
+            random.shuffle(rest)
+
+            self.__blocks = [_Block([])]
+            self.__block_of = {}
+            self._insert_ids(0, ids[:start] + rest)
+            self._changed()
+
+    @property
+    def position(self) -> int:
+        """
+        Index of the current entry, or -1 if there isn't one.
+        """
+        with self.__lock:
+            return -1 if self.__current is None else self.index_of(self.__current)
+
+    @position.setter
+    def position(self, i: int):
+        with self.__lock:
+            new = self.entry_id(min(i, len(self)-1)) if i >= 0 and len(self) else None
+            if new != self.__current:
+                self.__current = new
+                self._changed()
+
+    @property
+    def current(self) -> dict | None:
+        """
+        The song of the current entry.
+        """
+        with self.__lock:
+            return None if self.__current is None else self.__songs[self.__current]
+
+    @property
+    def current_id(self) -> int | None:
+        return self.__current
+
+    def upcoming(self) -> dict | None:
+        """
+        The song after the current entry, if any.
+        """
+        with self.__lock:
+            i = self.position + 1
+            return self[i] if i < len(self) else None
@@ -0,0 +1,80 @@
+"""
+Ring buffer used to hand audio from the decoder thread to the PyAudio callback.
+"""
+
+class RingBuffer:
+    """
+    Preallocated single-producer, single-consumer byte ring.
+
+    The producer only ever moves `written` and the consumer only ever moves `consumed`, so neither side
+    needs a lock. Both are running totals rather than offsets, which keeps "full" and "empty" apart and
+    lets them double as positions in the stream of audio.
+
+    Emptying the buffer (see `clear`) is requested by the producer, but carried out by the consumer the
+    next time it reads.
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self.__buf = bytearray(size)
+        self.__view = memoryview(self.__buf)
+        self.written = 0
+        self.consumed = 0
+        self.__clear_to = 0
+
+    def available(self) -> int:
+        """
+        Bytes waiting to be read.
+        """
+        return self.written - max(self.consumed, self.__clear_to)
+
+    def free(self) -> int:
+        """
+        Bytes that can be written without overwriting unread data.
+        """
+        return self.size - (self.written - self.consumed)
+
+    def write(self, data) -> int:
+        """
+        Copy as much of `data` as fits, returning how many bytes were written. Producer only.
+        """
+        n = min(len(data), self.free())
+        start = self.written % self.size
+        first = min(n, self.size - start)
+        self.__view[start:start+first] = data[:first]
+        if first < n: # wrap around
+            self.__view[:n-first] = data[first:n]
+        self.written += n
+        return n
+
+    def read_into(self, out) -> int:
+        """
+        Copy up to `len(out)` bytes into `out`, returning how many bytes were read. Consumer only.
+        """
+        if self.__clear_to > self.consumed:
+            self.consumed = self.__clear_to
+
+        n = min(len(out), self.written - self.consumed)
+        start = self.consumed % self.size
+        first = min(n, self.size - start)
+        out[:first] = self.__view[start:start+first]
+        if first < n:
+            out[first:n] = self.__view[:n-first]
+        self.consumed += n
+        return n
+
+    def reset(self):
+        """
+        Empty the buffer and start counting from zero again. Only safe while the consumer isn't running.
+        """
+        self.written = 0
+        self.consumed = 0
+        self.__clear_to = 0
+
+    def clear(self) -> int:
+        """
+        Drop everything that has been written so far. Producer only.
+
+        Returns the position new data will start at, which the consumer reaches once the old data is gone.
+        """
+        self.__clear_to = self.written
+        return self.written
@@ -0,0 +1,335 @@
+"""
+Fuzzy library search.
+
+Tracks are indexed by the trigrams of their title, artist and album. Queries are matched by how many
+of their trigrams a track contains, so small typos still find the right track.
+
+Matching works on bitmasks (one bit per track) of the tracks containing each trigram, so a query costs a
+few big int operations however many tracks it matches. Results are only turned back into tracks as they
+are looked at (see `Results`).
+"""
+import unicodedata
+from array import array
+from collections import deque
+from collections.abc import Sequence
+from itertools import repeat
+
+MIN_QUERY = 2 # single characters match far too much to be useful
+BITS_CACHE = 1024 # trigram bitmasks to keep around, each is a bit per track
+
+# lowercase ascii letters and digits, turn everything else into spaces
+ASCII = {_: chr(_).lower() if chr(_).isalnum() else " " for _ in range(128)}
+
+def normalize(text: str | None) -> str:
+    """
+    Lowercase a string, strip accents and replace anything that isn't a letter or number with spaces.
+    """
+    if not text:
+        return ""
+    if text.isascii(): # most tags, nothing to strip
+        return text.translate(ASCII)
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(_ if _.isalnum() else " " for _ in text if not unicodedata.combining(_))
+
+def document(song: dict) -> str:
+    """
+    The searchable text of a song. Words are separated by two spaces, so that a trigram can never
+    span two words.
+    """
+    info = song["info"]
+    words = f"{normalize(info['title'])} {normalize(info['artist'])} {normalize(info['album'])}".split()
+    return "  " + "  ".join(words) + "  "
+
+def trigrams(text: str, partial: bool = False) -> list:
+    """
+    Split a string into the trigrams of its words, padded so that short words and word starts still count.
+
+    When `partial` is set, the last word's end isn't padded, since the user is most likely still typing it.
+    """
+    grams = []
+    words = text.split()
+    for i, word in enumerate(words):
+        padded = f"  {word}" if partial and i == len(words)-1 else f"  {word} "
+        grams.extend(padded[_:_+3] for _ in range(len(padded)-2))
+    return list(dict.fromkeys(grams)) # remove duplicates, keeping order
+
+def _mask(docs, size: int) -> int:
+    """
+    Turn doc ids (below `size`) into a bitmask.
+    """
+    if len(docs) * 16 < size: # few enough to set one by one
+        bits = bytearray(size // 8 + 1)
+        for doc in docs:
+            bits[doc >> 3] |= 1 << (doc & 7)
+        return int.from_bytes(bits, "little")
+
+    digits = bytearray(b"0" * size)
+    deque(map(digits.__setitem__, docs, repeat(ord("1"))), maxlen=0) # no python loop per doc
+    digits.reverse() # doc 0 is the lowest bit
+    return int(digits, 2) if digits else 0
+
+def _docs(mask: int):
+    """
+    Iterate over the doc ids in a bitmask, in order.
+    """
+    digits = format(mask, "b")
+    end = len(digits)
+    while (pos := digits.rfind("1", 0, end)) >= 0:
+        yield len(digits) - 1 - pos
+        end = pos
+
+class Results(Sequence):
+    """
+    Matching songs, best first. Songs are only looked up as they are accessed, so a query matching most of
+    the library costs nothing until its results are scrolled through.
+    """
+    def __init__(self, songs: list, tiers: list, limit: int | None = None):
+        self.__songs = songs
+        self.__ids = (doc for tier in tiers for doc in _docs(tier))
+        self.__docs = []
+        self.__len = sum(_.bit_count() for _ in tiers)
+        if limit is not None:
+            self.__len = min(self.__len, limit)
+
+    def _fill(self, n: int):
+        while len(self.__docs) < n:
+            self.__docs.append(next(self.__ids))
+
+    def __len__(self) -> int:
+        return self.__len
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            indices = range(*i.indices(self.__len))
+            if not indices:
+                return []
+            self._fill(max(indices[0], indices[-1]) + 1)
+            return [self.__songs[self.__docs[_]] for _ in indices]
+
+        if i < 0:
+            i += self.__len
+        if not 0 <= i < self.__len:
+            raise IndexError("results index out of range")
+        self._fill(i+1)
+        return self.__songs[self.__docs[i]]
+
+class Matches:
+    """
+    The documents matching a query, as bitmasks of those with the same score, best first (see
+    `SearchIndex.rank`). `docs` is every one of them.
+    """
+    def __init__(self, tiers: list):
+        self.tiers = tiers
+        self.docs = 0
+        for tier in tiers:
+            self.docs |= tier
+
+    def __len__(self) -> int:
+        return self.docs.bit_count()
+
+class SearchIndex:
+    """
+    A trigram inverted index over the library.
+
+    Posting lists are compact arrays of document ids, only turned into bitmasks for the trigrams that are
+    searched for. Removed songs are only marked as removed, and the index is rebuilt once enough of them
+    pile up.
+    """
+    def __init__(self, songs = (), threshold: float = 0.6):
+        self.threshold = threshold # fraction of a query's trigrams a track needs to match
+        self._reset()
+
+        for song in songs:
+            self.add(song)
+
+    def _reset(self):
+        self.__songs = [] # doc id -> song, or None if removed
+        self.__paths = {} # path -> doc id
+        self.__postings = {} # trigram -> array of doc ids
+        self.__bits = {} # trigram -> bitmask of its posting list, least recently used first
+        self.__alive = None # bitmask of every doc that wasn't removed, built when first needed
+        self.__removed = 0
+
+    def __len__(self) -> int:
+        return len(self.__paths)
+
+    def add(self, song: dict):
+        """
+        Add a song to the index, replacing any song that has the same path.
+        """
+        path = song["info"]["path"]
+        if path in self.__paths:
+            self.remove(path)
+
+        doc = len(self.__songs)
+        self.__songs.append(song)
+        self.__paths[path] = doc
+        if self.__alive is not None:
+            self.__alive |= 1 << doc
+
+        for gram in trigrams(document(song)):
+            postings = self.__postings.get(gram)
+            if postings is None:
+                postings = self.__postings[gram] = array("I")
+            postings.append(doc)
+            if gram in self.__bits:
+                self.__bits[gram] |= 1 << doc
+
+    def remove(self, path: str):
+        doc = self.__paths.pop(path, None)
+        if doc is None:
+            return
+        self.__songs[doc] = None
+        self.__removed += 1
+        if self.__alive is not None:
+            self.__alive &= ~(1 << doc)
+
+        if self.__removed > len(self.__paths): # mostly dead entries, start over
+            songs = [_ for _ in self.__songs if _ is not None]
+            self._reset()
+            for song in songs:
+                self.add(song)
+
+    def apply(self, updated: list, removed: list):
+        """
+        Apply a set of changes from `watcher.LibraryWatcher`.
+        """
+        for path in removed:
+            self.remove(path)
+        for song in updated:
+            self.add(song)
+
+    def _bits(self, gram: str) -> int:
+        bits = self.__bits.pop(gram, None)
+        if bits is None:
+            bits = _mask(self.__postings.get(gram, ()), len(self.__songs))
+            if len(self.__bits) >= BITS_CACHE:
+                del self.__bits[next(iter(self.__bits))]
+        self.__bits[gram] = bits # most recently used last
+        return bits
+
+    def warm(self, count: int = BITS_CACHE // 4):
+        """
+        Build the bitmasks of the `count` most common trigrams ahead of time, since those take the longest
+        and nearly every query has some of them.
+        """
+        for gram in sorted(self.__postings, key=lambda _: len(self.__postings[_]))[-count:]:
+            self._bits(gram)
+        self._alive()
+
+    def _alive(self) -> int:
+        if self.__alive is None:
+            self.__alive = _mask(self.__paths.values(), len(self.__songs))
+        return self.__alive
+
+    def _needed(self, grams: list) -> int:
+        # short queries are mostly word prefixes, so typos aren't allowed there
+        return len(grams) if len(grams) <= 3 else max(1, round(len(grams) * self.threshold))
+
+    def exact(self, query: str) -> bool:
+        """
+        Whether every trigram of `query` has to match. Only then are the matches of a longer query always
+        among the matches of this one.
+        """
+        grams = trigrams(normalize(query), partial=True)
+        return self._needed(grams) == len(grams)
+
+    def matches(self, query: str, candidates: int | None = None) -> Matches:
+        """
+        Find every document matching `query`.
+
+        Documents are ranked by how many of the query's trigrams they contain, except that those containing
+        every word (going by the trigrams inside each word) always rank first. `candidates` limits the search
+        to a bitmask of docs (see `SearchSession`). That is only correct if they are the matches of an
+        `exact` query that this one extends.
+        """
+        query = normalize(query)
+        grams = trigrams(query, partial=True)
+        if len(query.replace(" ", "")) < MIN_QUERY:
+            return Matches([])
+
+        needed = self._needed(grams)
+        docs = self._alive() if candidates is None else candidates
+        bits = sorted((self._bits(_) for _ in grams), key=int.bit_count) # rarest first, empties out sooner
+
+        # at_least[i] = docs containing at least i of the trigrams seen so far, only kept for counts that
+        # can still reach `needed`
+        at_least = [docs] + [0] * len(grams)
+        for seen, gram in enumerate(bits, 1):
+            for i in range(seen, max(needed - len(grams) + seen, 1) - 1, -1):
+                at_least[i] |= at_least[i-1] & gram
+
+        whole = docs
+        for gram in grams:
+            if " " not in gram:
+                whole &= self._bits(gram)
+
+        tiers = []
+        for rank in (whole, ~whole):
+            for i in range(len(grams), needed-1, -1):
+                tiers.append(at_least[i] & ~at_least[i+1] & rank if i < len(grams) else at_least[i] & rank)
+        return Matches([_ for _ in tiers if _])
+
+    def rank(self, matches: Matches, limit: int | None = 50) -> Sequence:
+        """
+        Turn `matches` into songs, best first. Equal scores keep the order the songs were added in.
+
+        Returns a list of up to `limit` songs, or every song as `Results` if there is no limit.
+        """
+        results = Results(self.__songs, matches.tiers, limit)
+        return results if limit is None else results[:]
+
+    def search(self, query: str, limit: int | None = 50) -> Sequence:
+        """
+        Search the library, returning up to `limit` songs, best match first.
+        """
+        return self.rank(self.matches(query), limit)
+
+    def session(self, limit: int | None = 50):
+        return SearchSession(self, limit)
+
+class SearchSession:
+    """
+    Search-as-you-type helper.
+
+    Remembers the matches for each query typed so far, so adding a character only has to narrow down the
+    previous matches (when those can't have missed anything, see `SearchIndex.exact`), and removing one is
+    free.
+    """
+    def __init__(self, index: SearchIndex, limit: int | None = 50):
+        self.index = index
+        self.limit = limit
+        self.query = ""
+        self.__history = [] # (query, matches) for each step of the current query
+
+    def update(self, query: str) -> Sequence:
+        """
+        Search for `query`, reusing the results of any previous query it extends.
+        """
+        self.query = query
+        if len(normalize(query).replace(" ", "")) < MIN_QUERY:
+            self.reset()
+            return []
+
+        while self.__history and not query.startswith(self.__history[-1][0]):
+            self.__history.pop() # backspaced (or replaced)
+
+        if self.__history and self.__history[-1][0] == query:
+            matches = self.__history[-1][1]
+        else:
+            previous = None
+            if self.__history:
+                last_query, last = self.__history[-1]
+                # fuzzy queries can match what an earlier query didn't, so those start over from the postings
+                if last.docs and self.index.exact(last_query) and self.index.exact(query):
+                    previous = last.docs
+            matches = self.index.matches(query, previous)
+            self.__history.append((query, matches))
+
+        return self.index.rank(matches, self.limit)
+
+    def reset(self):
+        """
+        Forget the matches of previous queries. Should be called whenever the index changes.
+        """
+        self.__history = []
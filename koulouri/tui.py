@@ -1,105 +1,290 @@
 import curses
 import traceback
-import sys
+import sys, os
+import math
+import select
+import signal
+import threading
+from queue import SimpleQueue
 from time import sleep
 from main import fetch_cache
-from player_pyaudio import Player, Data
+from player_pyaudio import Player
+from data import Data
+from library import LibraryIndex
+from search import SearchIndex
+from views import TracksView, FavoritesView, AlbumsView
+from playqueue import PlayQueue
+
+IDLE_TIMEOUT = 1.0 # longest the main loop waits without input, just in case something was missed
+POLL_INTERVAL = 0.05 # where waiting on stdin isn't possible (windows)
 
 class Window:
-    def __init__(self, player: Player, stdscr: curses.window):
+    def __init__(self, player: Player, stdscr: curses.window, watcher = None):
         self.stdscr = stdscr
         self.player = player
         self.data = Data()
         self.songs = []
-        self.queue = []
+        self.queue = PlayQueue()
+        self.index = LibraryIndex()
+        self.search = None # a `SearchSession`, once the index has been built in the background
+        self.watcher = watcher
 
         self.h, self.w = self.stdscr.getmaxyx()
 
         self.__user_inp = ""
         self.__running = True
         self.__mode = "tracks"
-        self.__index = -1
         self.__offset = 0
+        self.__changes = SimpleQueue() # library changes from the watcher thread
+        self.__indexed = SimpleQueue() # the search index, once `_build_search` is done
+        self.__unindexed = [] # library changes that happened while it was being built
+        self.__rows = {} # what is currently drawn on each row, see `_put`
+        self.__dirty = True # the list needs to be drawn again
+        self.__painted = False # something was drawn since the last refresh
+        self.__resized = False
+        self.__wake_r, self.__wake_w = os.pipe() # lets other threads interrupt `_wait`
+        self.__wake_lock = threading.RLock() # so nothing writes to the pipe as it is closed
+        os.set_blocking(self.__wake_r, False)
+        os.set_blocking(self.__wake_w, False)
+
+        if self.watcher:
+            self.watcher.add_listener(self._on_library_change)
+
+    def _on_library_change(self, updated: list, removed: list):
+        """
+        Watcher callback. Changes are only queued here, since the main loop owns `self.songs`.
+        """
+        self.__changes.put((updated, removed))
+        self._wake()
+
+    def _wake(self):
+        """
+        Interrupt `_wait`. Safe to call from any thread (or a signal handler).
+        """
+        with self.__wake_lock:
+            if self.__wake_w is None: # closed, we're exiting
+                return
+            try:
+                os.write(self.__wake_w, b"\0")
+            except BlockingIOError: # already woken
+                pass
+
+    def _on_resize(self, signum, frame):
+        self.__resized = True
+        self._wake()
+
+    def _wait(self, timeout: float | None):
+        """
+        Sleep until a key is pressed, `_wake` is called or `timeout` seconds have passed.
+        """
+        if sys.platform == "win32": # select only works on sockets there
+            sleep(min(timeout, POLL_INTERVAL) if timeout is not None else POLL_INTERVAL)
+            return
+        try:
+            select.select([sys.stdin, self.__wake_r], [], [], timeout)
+        except InterruptedError:
+            pass
+        try:
+            while os.read(self.__wake_r, 64):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _put(self, y: int, text: str, x: int = 0):
+        """
+        Draw `text` on row `y`, replacing whatever was there, unless the row already shows exactly that.
+        """
+        if self.__rows.get(y) == (x, text):
+            return
+        self.__rows[y] = (x, text)
+        try:
+            self.stdscr.move(y, 0)
+            self.stdscr.clrtoeol()
+            self.stdscr.addstr(y, x, text)
+        except curses.error: # terminal is most likely larger/smaller than we think, nothing to worry about
+            pass
+        self.__painted = True
+
+    def _invalidate(self, everything: bool = False):
+        """
+        Mark the list as dirty, or with `everything`, forget what is on screen and draw it all again.
+        """
+        self.__dirty = True
+        if everything:
+            self.__rows = {}
+            self.stdscr.clear()
+            self.__painted = True
+
+    def _apply_library_changes(self) -> bool:
+        """
+        Apply any queued library changes to the track list.
+
+        Returns True if anything changed.
+        """
+        if self.__changes.empty():
+            return False
+
+        while not self.__changes.empty():
+            updated, removed = self.__changes.get()
+            gone = set(removed)
+            changed = {_["info"]["path"]: _ for _ in updated}
+
+            songs = [changed.pop(_["info"]["path"], _) for _ in self.songs if _["info"]["path"] not in gone]
+            self.songs = sorted(songs + list(changed.values()), key=lambda d: d["info"]["album"])
+            self.index.apply(updated, removed)
+            if self.search:
+                self.search.index.apply(updated, removed)
+                self.search.reset()
+            else:
+                self.__unindexed.append((updated, removed))
+        return True
+
+    def _build_search(self, songs: list):
+        """
+        Build the search index on its own thread, since it takes a few seconds for a large library.
+        """
+        index = SearchIndex(songs)
+        index.warm()
+        self.__indexed.put(index)
+        self._wake()
+
+    def _search_ready(self) -> bool:
+        """
+        Start using the search index once it has been built, returning True if that is now.
+        """
+        if self.search or self.__indexed.empty():
+            return False
+        index = self.__indexed.get()
+        for updated, removed in self.__unindexed: # the index is of the songs from before these
+            index.apply(updated, removed)
+        self.__unindexed = []
+        self.search = index.session(None)
+        return True
 
     def main(self):
+        error = None
+        winch = getattr(signal, "SIGWINCH", None) # not on windows
+        previous_winch = signal.getsignal(winch) if winch else None
         try:
             self.stdscr.nodelay(True)
             curses.noecho()
             self.stdscr.keypad(True)
             song_meta = fetch_cache()
             self.songs = sorted(song_meta, key=lambda d: d["info"]["album"])
-            paused = False
+            self.index = LibraryIndex(self.songs)
+            threading.Thread(target=self._build_search, args=(self.songs,), name="koulouri-index", daemon=True).start()
+            self.queue = PlayQueue.load({_["id"]: _ for _ in self.songs})
+            restart = self.queue.resume # a restored queue picks up from the track that was playing
+            paused = restart is not None or self.queue.upcoming() is not None # and waits for <SPACE> to do so
+            tracks = TracksView(lambda: self.songs, self.index)
+            favorites = FavoritesView(lambda: self.songs, self.index, self.data)
+            albums = AlbumsView(self.index)
             insert = False # "insert mode"
             selected_song = None
             song_filter = ""
             lyric_scroll = True # auto scroll with lyrics
+            searching = False # typing into the search query
+            search_query = ""
+            search_results = []
             song_len = 0
+            transitions = self.player.transitions
+            drawn = None # what the list was last drawn from
+            timeout = 0 # until something on screen changes by itself
+            k = -1
+
+            if winch:
+                signal.signal(winch, self._on_resize)
 
             while self.__running:
-                sleep(0.05)
-                k = self.stdscr.getch() # to reload xy
+                if k == -1: # nothing happened last time, wait for something to
+                    self._wait(timeout)
+                k = self.stdscr.getch()
+                if k != -1: # keys can change pretty much anything in the list
+                    self.__dirty = True
+
+                if self.__resized:
+                    self.__resized = False
+                    try:
+                        lines, cols = os.get_terminal_size(sys.__stdout__.fileno())
+                        curses.resizeterm(lines, cols)
+                    except OSError:
+                        pass
+                    self._invalidate(everything=True)
+                if k == curses.KEY_RESIZE:
+                    self._invalidate(everything=True)
                 self.h, self.w = self.stdscr.getmaxyx()
 
+                changed = self._apply_library_changes()
+                if self._search_ready() or changed and self.search: # the results may be out of date
+                    search_results = self.search.update(search_query)
+                    changed = True
+                if changed:
+                    self._invalidate()
+
                 if self.__mode == "tracks":
-                    view = self.songs
+                    tracks.filter = song_filter
+                    view = tracks
                 elif self.__mode == "queue":
                     view = self.queue
                 elif self.__mode == "albums":
-                    view = list(dict.fromkeys([(_["info"]["artist"], _["info"]["album"]) for _ in self.songs])) # remove duplicates
-                    view = [{"id": "", "info": {"artist": _[0], "title": _[1]}} for _ in view] # convert back to dicts we can use
+                    view = albums
                 elif self.__mode == "favorites":
-                    view = [_ for _ in self.songs if self.data.is_favorite(_["id"])]
+                    view = favorites
+                elif self.__mode == "search":
+                    view = search_results
                 elif self.__mode == "lyrics" and selected_song:
                     view = self.player.fetch_lyrics(selected_song["info"]["path"])
                     # view = [{"artist": "", "title": str(_)} for _ in view]
                 else:
                     view = []
 
-                # filter view
-                if self.__mode in ["tracks"] and song_filter:
-                    view = [_ for _ in view if song_filter == _["info"]["album"]]
-
-                # lyrics rendering:
-                if self.__mode == "lyrics":
-                    now_at = self.player.get_time()
-                    lyric_times = []
-                    for lyric in view:
-                        lyric_at = float(lyric["tsec"]+(lyric["tmin"]*60))+float(lyric["tmil"])
-                        tscore =  now_at - lyric_at
-                        if tscore >= 0:
-                            lyric_times.append(tscore)
+                current = -1
+                lyric_times = None
+                if self.__mode == "lyrics" and view:
+                    current = view.line_at(self.player.get_time())
+                    lyric_times = view.times
 
                     # keep the current lyric in the center of the view
-                    if lyric_times and lyric_scroll:
-                        min_lyric = lyric_times.index(min(lyric_times))
-                        if min_lyric >= (self.h-3)//2:
-                            self.__offset = min_lyric - ((self.h-3)//2)
+                    if current >= 0 and lyric_scroll:
+                        if current >= (self.h-3)//2:
+                            self.__offset = current - ((self.h-3)//2)
 
-                    for i, line in enumerate(view[self.__offset:self.__offset+self.h-4]):
-                        entry = f"{line["lyric"]}"
+                # only draw the list if something in it could have changed
+                position = self.queue.position
+                state = (self.__mode, self.__offset, self.h, self.w, song_filter, position, self.queue.version,
+                         selected_song["id"] if selected_song else None, current)
+                if self.__dirty or state != drawn:
+                    self.__dirty = False
+                    drawn = state
+                    rows = []
 
-                        if lyric_times and line == view[lyric_times.index(min(lyric_times))]:
-                            entry = "~ " + entry
+                    if self.__mode == "lyrics": # lyrics rendering
+                        for i, line in enumerate(view[self.__offset:self.__offset+self.h-4]):
+                            entry = line
 
-                        entry_trimmed = entry[:self.w-3] + (entry[self.w-3:] and '...')
-                        self.stdscr.addstr(i+1, 0, entry_trimmed)
-                        self.stdscr.clrtoeol()
-                else:
-                    # track rendering
-                    for i, song in enumerate(view[self.__offset:self.__offset+self.h-4]):
-                        entry = f"{i+self.__offset}: {song["info"]["artist"]} - {song["info"]["title"]}"
-                        if selected_song and (selected_song == song or selected_song["info"]["album"] == song["info"]["title"]):
-                            if self.__mode == "queue" and (self.__index-self.__offset) != i: # mark only the current playing instance
-                                entry = "  " + entry
-                            else:
+                            if i+self.__offset == current:
                                 entry = "~ " + entry
-                        else:
-                            entry = "  " + entry
-                        entry_trimmed = entry[:self.w-3] + (entry[self.w-3:] and '...')
-                        self.stdscr.addstr(i+1, 0, entry_trimmed)
-                        self.stdscr.clrtoeol()
+                            rows.append(entry)
+                    else:
+                        # track rendering
+                        for i, song in enumerate(view[self.__offset:self.__offset+self.h-4]):
+                            entry = f"{i+self.__offset}: {song["info"]["artist"]} - {song["info"]["title"]}"
+                            if selected_song and (selected_song == song or selected_song["info"]["album"] == song["info"]["title"]):
+                                if self.__mode == "queue" and (position-self.__offset) != i: # mark only the current playing instance
+                                    entry = "  " + entry
+                                else:
+                                    entry = "~ " + entry
+                            else:
+                                entry = "  " + entry
+                            rows.append(entry)
+
+                    for i in range(max(self.h-4, 0)):
+                        entry = rows[i] if i < len(rows) else ""
+                        self._put(i+1, entry[:self.w-3] + (entry[self.w-3:] and '...'))
 
-                if insert and song_filter:
+                if self.__mode == "search" and searching:
+                    userinpstr = f"[/]: {search_query}" + ("" if self.search else "  (indexing...)")
+                elif insert and song_filter:
                     userinpstr = f"[E|I]: {song_filter}/{self.__user_inp}"
                 elif insert:
                     userinpstr = f"[I]: {self.__user_inp}"
@@ -108,22 +293,38 @@ class Window:
                 else:
                     userinpstr = f": {self.__user_inp}"
                 # userinpstr = f": {self.__user_inp}" if not insert else f"[I]: {self.__user_inp}"
-                self.stdscr.addstr(self.h-3, 0, userinpstr)
-                self.stdscr.clrtoeol()
+                self._put(self.h-3, userinpstr)
 
                 # CONTROLS
 
+                if self.__mode == "search" and searching and k != -1:
+                    # everything typed goes into the query, narrowing the results on every key
+                    query = search_query
+                    if k in [curses.KEY_BACKSPACE, 127]:
+                        query = query[:-1]
+                    elif k in [curses.KEY_ENTER, 10, 13, 27]: # done typing, allow the view to be used
+                        searching = False
+                    elif 32 <= k < 127:
+                        query += chr(k)
+
+                    if query != search_query:
+                        search_query = query
+                        search_results = self.search.update(query) if self.search else [] # until it's indexed
+                        self.__offset = 0
+                    self._invalidate()
+                    k = -1
+
                 if k in [curses.KEY_BACKSPACE, 127]:
                     self.__user_inp = self.__user_inp[:len(self.__user_inp)-1]
                 elif k == curses.KEY_DOWN and view:
                     self.__offset += 1
                     self.__offset %= (len(view))
-                    self.stdscr.clear()
+                    self._invalidate()
                     lyric_scroll = False # allow manual control over lyric view
                 elif k == curses.KEY_UP and view:
                     self.__offset -= 1
                     self.__offset %= (len(view))
-                    self.stdscr.clear()
+                    self._invalidate()
                     lyric_scroll = False
                 elif k == curses.KEY_RIGHT and selected_song:
                     self.player.seek(round(self.player.get_time()+5))
@@ -133,23 +334,19 @@ class Window:
                     try:
                         k = int(self.__user_inp)
                         self.__user_inp = ""
-                        if k in range(len(view)) and self.__mode in ["tracks", "favorites"]:
-                            self.queue.append(view[k]) if not insert else self.queue.insert(self.__index+1, view[k])
+                        if k in range(len(view)) and self.__mode in ["tracks", "favorites", "search"]:
+                            self.queue.append(view[k]) if not insert else self.queue.insert(self.queue.position+1, view[k])
                         elif k in range(len(self.queue)) and self.__mode == "queue":
-                            self.queue.remove(self.queue[k])
-
-                            # adjust the index if we've moved positions
-                            if self.__index >= k and self.__index > -1:
-                                self.__index -= 1
+                            self.queue.pop(k) # the queue keeps track of where we are
                         elif k in range(len(view)) and self.__mode == "albums":
-                            album = [_ for _ in self.songs if _["info"]["album"] == view[k]["info"]["title"]]
+                            album = self.index.tracks(view[k]["info"]["title"]) # already sorted by track
                             if not insert:
-                                self.queue.extend(sorted(album, key=lambda d: d["info"]["track"]))
+                                self.queue.extend(album)
                             else:
-                                self.queue[self.__index+1:] = sorted(album, key=lambda d: d["info"]["track"]) + self.queue[self.__index+1:]
+                                self.queue.insert(self.queue.position+1, album)
                         else:
                             continue
-                        self.stdscr.clear()
+                        self._invalidate()
                     except:
                         sleep(0.005)
                         continue
@@ -160,26 +357,34 @@ class Window:
                 elif chr(k) == "q":
                     self.__mode = "queue"
                     self.__offset = 0
-                    self.stdscr.clear()
+                    self._invalidate()
                 elif chr(k) == "t":
                     self.__mode = "tracks"
                     self.__offset = 0
-                    self.stdscr.clear()
+                    self._invalidate()
                 elif chr(k) == "a":
                     self.__mode = "albums"
                     self.__offset = 0
-                    self.stdscr.clear()
+                    self._invalidate()
 
                     song_filter = ""
                 elif chr(k) == "l":
                     self.__mode = "lyrics"
                     lyric_scroll = True # reset auto scroll
                     self.__offset = 0
-                    self.stdscr.clear()
+                    self._invalidate()
                 elif chr(k) == "f":
                     self.__mode = "favorites"
                     self.__offset = 0
-                    self.stdscr.clear()
+                    self._invalidate()
+                elif chr(k) == "/":
+                    if self.__mode != "search" and self.search:
+                        search_results = self.search.update(search_query)
+                    self.__mode = "search"
+                    searching = True
+                    self.__user_inp = ""
+                    self.__offset = 0
+                    self._invalidate()
                 elif chr(k) == "e":
                     if not self.__user_inp:
                         song_filter = ""
@@ -188,34 +393,35 @@ class Window:
                     elif self.__mode == "albums":
                         song_filter = view[int(self.__user_inp)]["info"]["title"]
                         self.__mode = "tracks" # the only view that will properly show tracks
-                    elif self.__mode == "favorites":
+                    elif self.__mode in ["favorites", "search"]:
                         song_filter = view[int(self.__user_inp)]["info"]["album"]
                         self.__mode = "tracks"
 
                     self.__user_inp = ""
                     self.__offset = 0
-                    self.stdscr.clear()
+                    self._invalidate()
                 elif chr(k) == "*":
                     if not self.__user_inp and selected_song:
                         self.data.toggle_favorite(selected_song["id"])
-                    if self.__mode in ["tracks", "favorites"] and (self.__user_inp and int(self.__user_inp) in range(len(view))):
+                    if self.__mode in ["tracks", "favorites", "search"] and (self.__user_inp and int(self.__user_inp) in range(len(view))):
                         self.data.toggle_favorite(view[int(self.__user_inp)]["id"])
                         self.__user_inp = ""
-                    self.stdscr.clear()
+                    self._invalidate()
                 elif chr(k) == "i":
                     insert = not insert
                 elif chr(k) == "n":
+                    restart = None
                     self.player.stop()
                     selected_song = None
                 elif chr(k) == "p":
                     if self.player.get_time() > 5:
-                        self.__index -= 1
+                        self.queue.position -= 1
                         self.player.stop()
                         selected_song = None
-                    elif self.__index <= 0:
+                    elif self.queue.position <= 0:
                         pass
                     else:
-                        self.__index -= 2
+                        self.queue.position -= 2
                         self.player.stop()
                         selected_song = None
 
@@ -228,66 +434,96 @@ class Window:
 
                     if paused:
                         self.player.pause()
-                    else:
+                    elif selected_song: # otherwise the next track starts below
                         self.player.resume()
 
-                if (not self.player.is_playing()[1] and not paused) and (self.queue and self.__index < len(self.queue)-1):
-                    self.__index += 1
-                    selected_song = self.queue[self.__index]
+                if self.player.transitions != transitions: # the player moved on to the hinted track by itself
+                    transitions = self.player.transitions
+                    if self.queue.upcoming():
+                        self.queue.position += 1
+                        selected_song = self.queue.current
+                        song_len = selected_song["info"]["duration"]
+                        self._invalidate()
+
+                if restart is not None and restart != self.queue.current_id: # moved elsewhere in the meantime
+                    restart = None
+                if (not self.player.is_playing()[1] and not paused) and (restart is not None or self.queue.upcoming()):
+                    if restart is None:
+                        self.queue.position += 1
+                    restart = None
+                    selected_song = self.queue.current
                     self.player.stop() # ensure that we stop anything currently playing
-                    self.player.play(selected_song["info"]["path"], selected_song["info"]["type"])
+                    self.player.play(selected_song["info"]["path"], selected_song["info"]["type"], selected_song["id"])
                     song_len = selected_song["info"]["duration"]
                     paused = False
-                elif (not self.player.is_playing()[1] and not paused) and (self.queue and self.__index == len(self.queue)-1):
+                elif (not self.player.is_playing()[1] and not paused) and self.queue and self.queue.position == len(self.queue)-1:
                     selected_song = None
                     self.player.stop()
 
-                try:
-                    volume = self.player.volume
-                    title_str = f"koulouri  / [{volume}%] /  {self.__mode}"
-                    title_mid = (self.w//2)-(len(title_str)//2)
-                    self.stdscr.move(0, 0) # ensure title is cleared, since it may have left behind text in front of it
-                    self.stdscr.clrtoeol()
-                    self.stdscr.addstr(0, title_mid, title_str)
-                    self.stdscr.refresh()
-                except:
-                    pass
+                # let the player prepare whatever comes next, so there's no gap between tracks
+                upcoming = self.queue.upcoming()
+                if selected_song and upcoming and self.queue.position > -1:
+                    self.player.queue_next(upcoming["info"]["path"], upcoming["info"]["type"], upcoming["id"])
+                else:
+                    self.player.queue_next(None)
 
+                volume = self.player.volume
+                title_str = f"koulouri  / [{volume}%] /  {self.__mode}"
+                self._put(0, title_str, max((self.w//2)-(len(title_str)//2), 0))
+
+                timeout = IDLE_TIMEOUT
                 if self.player.is_active() and selected_song:
-                    try:
-                        # progress bar / now playing
-                        # now_at = self.player.mixer.get_pos()/1000
-                        now_at = self.player.get_time()
-                        is_favorite = "*" if self.data.is_favorite(selected_song["id"]) else ""
-                        symbol = ">" if not paused else "#"
-                        prog_bar = "="*round((self.w-14)*((now_at)/song_len))
-                        now_playing = f"{self.__index+1} of {len(self.queue)}, {is_favorite}{selected_song["info"]["artist"]} - {selected_song["info"]["title"]}"
-                        nplaying_trimmed = now_playing[:self.w-3] + (now_playing[self.w-3:] and '...')
-                        # prog_bar = self.player.mixer.get_pos()/1000
-                        final_prog = f"{round(now_at//60):02d}:{round(now_at%60):02d}-{round(song_len//60):02d}:{round(song_len%60):02d} {symbol}{prog_bar}"
-                        self.stdscr.addstr(self.h-1, 0, final_prog)
-                        self.stdscr.clrtoeol()
-                        self.stdscr.addstr(self.h-2, 0, nplaying_trimmed)
-                        self.stdscr.clrtoeol()
-                    except: # terminal is most likely larger/smaller than we think, nothing to worry about
-                        # selected_song = None
-                        pass
+                    # progress bar / now playing
+                    # now_at = self.player.mixer.get_pos()/1000
+                    now_at = self.player.get_time()
+                    is_favorite = "*" if self.data.is_favorite(selected_song["id"]) else ""
+                    symbol = ">" if not paused else "#"
+                    prog_bar = "="*round((self.w-14)*((now_at)/song_len)) if song_len else ""
+                    now_playing = f"{self.queue.position+1} of {len(self.queue)}, {is_favorite}{selected_song["info"]["artist"]} - {selected_song["info"]["title"]}"
+                    nplaying_trimmed = now_playing[:self.w-3] + (now_playing[self.w-3:] and '...')
+                    # prog_bar = self.player.mixer.get_pos()/1000
+                    final_prog = f"{round(now_at//60):02d}:{round(now_at%60):02d}-{round(song_len//60):02d}:{round(song_len%60):02d} {symbol}{prog_bar}"
+                    self._put(self.h-1, final_prog)
+                    self._put(self.h-2, nplaying_trimmed)
+
+                    if not paused: # wake up in time for the next visible change, or the end of the track
+                        changes = [math.floor(now_at+0.5)+0.5 - now_at, self.player.get_remaining()]
+                        if song_len and self.w > 14:
+                            step = song_len/(self.w-14) # seconds per character of the progress bar
+                            changes.append((math.floor(now_at/step+0.5)+0.5)*step - now_at)
+                        if lyric_times and current+1 < len(lyric_times): # the next lyric
+                            changes.append(lyric_times[current+1] - now_at)
+                        timeout = min(max(min(changes), 0.01), IDLE_TIMEOUT)
+                else:
+                    self._put(self.h-2, "")
+                    self._put(self.h-1, "")
 
+                if self.__painted:
+                    self.__painted = False
                     self.stdscr.refresh()
         except KeyboardInterrupt:
-            self.player.stop()
+            pass
+        except Exception:
+            error = sys.exc_info()
+        finally:
+            # nothing may wake us once the pipe is closed, so stop whatever could first
+            if self.watcher:
+                self.watcher.stop()
+            if winch:
+                signal.signal(winch, previous_winch if previous_winch is not None else signal.SIG_DFL)
+            with self.__wake_lock: # the index may still be building, and wakes us when it's done
+                os.close(self.__wake_r)
+                os.close(self.__wake_w)
+                self.__wake_w = None
+            self.player.exit()
             # restore terminal to normal state
             curses.echo()
             curses.endwin()
             self.stdscr.keypad(False)
-        except Exception as e:
-            self.player.stop()
-            curses.echo()
-            curses.endwin()
-            self.stdscr.keypad(False)
 
+        if error:
             print("an error occured and Koulouri had to exit.")
-            exc_type, exc_value, exc_traceback = sys.exc_info()
+            exc_type, exc_value, exc_traceback = error
             # Extract traceback details
             tb = traceback.extract_tb(exc_traceback)[-1]
             modu = tb.filename.split("/")[-1].removesuffix(".py")
@@ -297,6 +533,6 @@ class Window:
             # print()
 
     def play_single(self, index: int):
-        self.__index = index
+        self.queue.position = index
         
         self.main()
@@ -0,0 +1,116 @@
+"""
+Adaptive output buffer sizing.
+
+Starts small, grows the buffers whenever playback underruns, and slowly shrinks them again once things
+have been quiet for a while, not going back down to a size that has underrun recently. The sizes that
+worked are remembered per output device in `kaudio.json`.
+"""
+import os
+import json
+import time
+import logging
+
+SETTINGS_PATH = "kaudio.json"
+
+class BufferTuner:
+    """
+    Picks `frames` (frames per stream buffer, which is also how much the producer decodes at a time) and
+    `chunks` (how many of those the ring buffer holds) for one output device.
+
+    Underruns are reported from the stream callback with `underflow` (the device ran dry) and `starved`
+    (the ring buffer ran dry), which only bump counters. The sizes themselves only change in `update`.
+    """
+    def __init__(self, device: str, min_frames: int = 256, max_frames: int = 8192, min_chunks: int = 4,
+                 max_chunks: int = 32, settle: float = 300.0, decay: float = 3600.0, path: str = SETTINGS_PATH):
+        self.device = device
+        self.min_frames = min_frames
+        self.max_frames = max_frames
+        self.min_chunks = min_chunks
+        self.max_chunks = max_chunks
+        self.settle = settle # seconds without underruns before shrinking
+        self.decay = decay # seconds without underruns before sizes that underran are worth another try
+        self.path = path
+
+        self.frames = 1024
+        self.chunks = 8
+        self.__floor_frames = min_frames # smallest sizes that haven't underrun
+        self.__floor_chunks = min_chunks
+        self.__underflows = 0
+        self.__starved = 0
+        self.__seen = (0, 0) # counters as of the last update
+        self.__quiet_since = time.monotonic()
+        self.__floors_since = self.__quiet_since # when the floors last went up (or down)
+
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                saved = json.load(f).get(self.device)
+        except (OSError, ValueError):
+            return
+        if not saved:
+            return
+        self.frames = min(max(saved.get("frames", self.frames), self.min_frames), self.max_frames)
+        self.chunks = min(max(saved.get("chunks", self.chunks), self.min_chunks), self.max_chunks)
+        self.__floor_frames = min(max(saved.get("floor_frames", self.min_frames), self.min_frames), self.frames)
+        self.__floor_chunks = min(max(saved.get("floor_chunks", self.min_chunks), self.min_chunks), self.chunks)
+
+    def save(self):
+        """
+        Remember the current sizes for this device.
+        """
+        try:
+            with open(self.path, "r") as f:
+                settings = json.load(f)
+        except (OSError, ValueError):
+            settings = {}
+
+        settings[self.device] = {"frames": self.frames, "chunks": self.chunks,
+                                 "floor_frames": self.__floor_frames, "floor_chunks": self.__floor_chunks}
+        try:
+            with open(f"{self.path}.tmp", "w") as f:
+                json.dump(settings, f)
+            os.replace(f"{self.path}.tmp", self.path)
+        except OSError as e:
+            logging.warning(f"unable to save buffer sizes: {e}")
+
+    def underflow(self):
+        self.__underflows += 1
+
+    def starved(self):
+        self.__starved += 1
+
+    def update(self) -> bool:
+        """
+        Adjust the sizes according to the underruns since the last update. Returns True if they changed.
+        """
+        underflows, starved = self.__underflows, self.__starved
+        new_underflows, new_starved = underflows - self.__seen[0], starved - self.__seen[1]
+        self.__seen = (underflows, starved)
+        frames, chunks = self.frames, self.chunks
+        now = time.monotonic()
+
+        if new_underflows or new_starved:
+            self.__quiet_since = now
+            self.__floors_since = now
+            if new_underflows: # the device needs bigger buffers
+                self.__floor_frames = max(self.__floor_frames, min(self.frames * 2, self.max_frames))
+                self.frames = self.__floor_frames
+            if new_starved: # decoding can't keep up, hold more audio ahead of time
+                self.__floor_chunks = max(self.__floor_chunks, min(self.chunks * 2, self.max_chunks))
+                self.chunks = self.__floor_chunks
+        elif now - self.__quiet_since >= self.settle: # try a little less latency
+            self.__quiet_since = now
+            if now - self.__floors_since >= self.decay: # one stall shouldn't cost latency forever
+                self.__floors_since = now
+                self.__floor_frames = max(self.__floor_frames // 2, self.min_frames)
+                self.__floor_chunks = max(self.__floor_chunks // 2, self.min_chunks)
+            self.frames = max(self.frames // 2, self.__floor_frames)
+            self.chunks = max(self.chunks // 2, self.__floor_chunks)
+
+        if (frames, chunks) == (self.frames, self.chunks):
+            return False
+        logging.debug(f"{self.device}: buffers now {self.frames} frames x {self.chunks}")
+        self.save()
+        return True
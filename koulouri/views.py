@@ -0,0 +1,102 @@
+"""
+Cached rows for the TUI's list modes.
+
+Each view remembers what its rows were built from, and only rebuilds them once one of those inputs (the
+library, the favorites, a filter...) has actually changed. Indexing and slicing a view only turns the
+rows that are asked for into displayable entries, so drawing a screenful never touches the rest.
+"""
+
+class View:
+    """
+    Base view. Subclasses implement `_inputs`, which should return something that changes whenever the
+    rows would, and `_build`. `_row` can be overridden to turn a stored item into what the TUI expects.
+    """
+    def __init__(self):
+        self.__items = []
+        self.__inputs = None
+
+    def _inputs(self):
+        raise NotImplementedError
+
+    def _build(self) -> list:
+        raise NotImplementedError
+
+    def _row(self, item):
+        return item
+
+    def items(self) -> list:
+        """
+        The underlying items, rebuilt first if they are out of date.
+        """
+        inputs = self._inputs()
+        if inputs != self.__inputs:
+            self.__items = self._build()
+            self.__inputs = inputs
+        return self.__items
+
+    def invalidate(self):
+        """
+        Force a rebuild the next time the view is used.
+        """
+        self.__inputs = None
+
+    def __len__(self) -> int:
+        return len(self.items())
+
+    def __getitem__(self, i):
+        items = self.items()
+        if isinstance(i, slice):
+            return [self._row(_) for _ in items[i]]
+        return self._row(items[i])
+
+class TracksView(View):
+    """
+    Every track, or only those of the album in `filter`.
+
+    `songs` is called for the full track list, since the TUI replaces it whenever the library changes.
+    """
+    def __init__(self, songs, index):
+        super().__init__()
+        self.songs = songs
+        self.index = index
+        self.filter = ""
+
+    def _inputs(self):
+        return (self.index.version, self.filter)
+
+    def _build(self) -> list:
+        if self.filter:
+            return self.index.tracks(self.filter) # already sorted by track
+        return self.songs()
+
+class FavoritesView(TracksView):
+    """
+    Every favorite track, in library order.
+    """
+    def __init__(self, songs, index, data):
+        super().__init__(songs, index)
+        self.data = data
+
+    def _inputs(self):
+        return (self.index.version, self.data.version)
+
+    def _build(self) -> list:
+        favorites = set(self.data.favorites)
+        return [_ for _ in self.songs() if _["id"] in favorites]
+
+class AlbumsView(View):
+    """
+    Every album, as rows shaped like tracks (the album title being the track title).
+    """
+    def __init__(self, index):
+        super().__init__()
+        self.index = index
+
+    def _inputs(self):
+        return self.index.version
+
+    def _build(self) -> list:
+        return self.index.albums()
+
+    def _row(self, album) -> dict:
+        return {"id": "", "info": {"artist": album.artist, "title": album.title}}
@@ -0,0 +1,313 @@
+"""
+Live library updates.
+
+Watches the music folders for changes using inotify (Linux only), falling back to periodically
+stat-ing every file elsewhere. Bursts of changes are debounced, and only the affected files are
+probed again before being handed to any listeners.
+"""
+import ctypes, ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+import logging
+from main import walk_songs, fingerprint, probe_song, matches
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+              | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT = struct.Struct("iIII")
+
+class Inotify:
+    """
+    Minimal `ctypes` wrapper around the Linux inotify API.
+
+    Raises `OSError` if inotify isn't available (or we've run out of watches).
+    """
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name:
+            raise OSError("libc not found")
+        self.__libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.__libc, "inotify_init1"):
+            raise OSError("inotify is not supported on this platform")
+
+        self.fd = self.__libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.__watches = {} # wd -> directory
+
+    def add(self, path: str):
+        wd = self.__libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"unable to watch '{path}'")
+        self.__watches[wd] = path
+
+    def add_tree(self, root: str, skip = None):
+        """
+        Watch a directory and every directory below it, skipping any we've already seen, and any that
+        `skip(path)` returns True for (along with everything below them).
+        """
+        seen = set()
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            if skip and skip(path):
+                continue
+            try:
+                stat = os.stat(path)
+                if (stat.st_dev, stat.st_ino) in seen:
+                    continue
+                seen.add((stat.st_dev, stat.st_ino))
+                self.add(path)
+                with os.scandir(path) as entries:
+                    stack.extend(f"{path}/{_.name}" for _ in entries if _.is_dir())
+            except FileNotFoundError: # removed before we got to it
+                continue
+
+    def read(self) -> list:
+        """
+        Read any queued events, returning a list of (path, mask) tuples.
+        """
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+
+        events = []
+        pos = 0
+        while pos + EVENT.size <= len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, pos)
+            name = data[pos+EVENT.size:pos+EVENT.size+length].rstrip(b"\x00")
+            pos += EVENT.size + length
+
+            parent = self.__watches.get(wd)
+            if mask & IN_IGNORED:
+                self.__watches.pop(wd, None)
+                continue
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+            elif parent is not None:
+                events.append((f"{parent}/{os.fsdecode(name)}" if name else parent, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class LibraryWatcher:
+    """
+    Watch a set of music folders, notifying listeners whenever songs are added, changed or removed.
+
+    Listeners are called from the watcher's thread with a list of updated (or new) cache entries and a
+    list of removed paths.
+    """
+    def __init__(self, roots: list, songs = (), debounce: float = 1.0, interval: float = 30.0,
+                 include: list | None = None, exclude: list | None = None, polling: bool = False):
+        self.roots = [_ for _ in roots if os.path.isdir(_)]
+        self.debounce = debounce
+        self.interval = interval # only used when polling
+        self.include = include
+        self.exclude = exclude
+        self.mode = "polling" if polling else "inotify"
+
+        self.__known = {_["info"]["path"]: _.get("stat") for _ in songs}
+        self.__listeners = []
+        self.__stop = threading.Event()
+        self.__thread = None
+        self.__wake_r, self.__wake_w = None, None # only used to interrupt inotify's select
+
+    def add_listener(self, callback):
+        """
+        Register a `callback(updated: list, removed: list)` to be called on changes.
+        """
+        self.__listeners.append(callback)
+
+    def start(self):
+        """
+        Start the watcher thread.
+        """
+        inotify = None
+        if self.mode == "inotify":
+            try:
+                inotify = Inotify()
+                for root in self.roots:
+                    inotify.add_tree(root, self._excluded)
+                self.__wake_r, self.__wake_w = os.pipe()
+            except OSError as e: # not on linux, or too many folders for the watch limit
+                logging.warning(f"inotify unavailable ({e}), falling back to polling")
+                if inotify:
+                    inotify.close()
+                inotify = None
+                self.mode = "polling"
+
+        self.__stop.clear()
+        target = self._inotify_loop if inotify else self._poll_loop
+        self.__thread = threading.Thread(target=target, args=(inotify,) if inotify else (), daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stop the watcher thread, discarding any changes that are still being debounced.
+        """
+        self.__stop.set()
+        if self.__wake_w is not None:
+            os.write(self.__wake_w, b"\x00")
+        if self.__thread:
+            self.__thread.join()
+
+    def _root_of(self, path: str) -> str | None:
+        for root in self.roots:
+            if path == root or path.startswith(f"{root}/"):
+                return root
+        return None
+
+    def _excluded(self, path: str) -> bool:
+        """
+        Whether or not a directory (or one of the directories above it) is skipped by a full scan.
+        """
+        root = self._root_of(path)
+        if root is None or path == root or not self.exclude:
+            return False
+        parts = path[len(root)+1:].split("/")
+        return any(matches("/".join(parts[:i]), self.exclude) for i in range(1, len(parts)+1))
+
+    def _wanted(self, path: str) -> bool:
+        """
+        Whether or not a file would have been picked up by a full scan.
+        """
+        root = self._root_of(path)
+        if root is None or path.split(".")[-1] not in ["flac", "mp3"]:
+            return False
+        if self._excluded(path.rsplit("/", 1)[0]): # walk_songs never enters excluded directories
+            return False
+        relative = path[len(root)+1:]
+        return not (matches(relative, self.exclude) or (self.include and not matches(relative, self.include)))
+
+    def _emit(self, updated: list, removed: list):
+        if not updated and not removed:
+            return
+        logging.debug(f"library changed: {len(updated)} updated, {len(removed)} removed")
+        for listener in self.__listeners:
+            try:
+                listener(updated, removed)
+            except Exception:
+                logging.exception("library listener failed")
+
+    def _probe(self, songs, updated: list) -> set:
+        """
+        Probe any songs that are new or have changed, returning every path that still exists.
+        """
+        found = set()
+        for path, type in songs:
+            if not self._wanted(path):
+                continue
+            try:
+                stat = fingerprint(path)
+            except OSError:
+                continue
+            found.add(path)
+            if self.__known.get(path) == stat:
+                continue
+            try:
+                entry = probe_song((path, type), stat)
+            except Exception: # most likely still being written
+                logging.exception(f"unable to probe '{path}'")
+                continue
+            self.__known[path] = stat
+            updated.append(entry)
+        return found
+
+    def _process(self, paths: set):
+        """
+        Re-probe only the paths (files or folders) that events were received for.
+        """
+        updated, removed = [], []
+        for path in paths:
+            if os.path.isdir(path):
+                try:
+                    found = self._probe(walk_songs(path, self.include, self.exclude), updated)
+                except OSError as e: # we don't know what's still there, so don't remove anything
+                    logging.warning(f"unable to rescan '{path}': {e}")
+                    continue
+            elif os.path.isfile(path):
+                found = self._probe([(path, path.split(".")[-1])], updated)
+            else:
+                found = set()
+
+            # anything we knew of at (or under) this path that wasn't found is gone
+            for known in [_ for _ in self.__known if _ == path or _.startswith(f"{path}/")]:
+                if known not in found:
+                    del self.__known[known]
+                    removed.append(known)
+
+        self._emit(updated, removed)
+
+    def _scan(self):
+        """
+        Compare every song against the last known state. Used when polling, or when inotify overflows.
+        """
+        updated, found = [], set()
+        for root in self.roots:
+            try:
+                found |= self._probe(walk_songs(root, self.include, self.exclude), updated)
+            except OSError:
+                continue
+
+        removed = [_ for _ in self.__known if _ not in found]
+        for path in removed:
+            del self.__known[path]
+        self._emit(updated, removed)
+
+    def _inotify_loop(self, inotify: Inotify):
+        pending = set()
+        first_at = last_at = 0
+
+        try:
+            while not self.__stop.is_set():
+                timeout = self.debounce if pending else None
+                ready = select.select([inotify.fd, self.__wake_r], [], [], timeout)[0]
+                if self.__wake_r in ready:
+                    break
+
+                now = time.monotonic()
+                if inotify.fd in ready:
+                    for path, mask in inotify.read():
+                        if path is None: # the kernel dropped events, so we need to check everything
+                            self._scan()
+                            continue
+                        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                            try:
+                                inotify.add_tree(path, self._excluded)
+                            except OSError as e:
+                                logging.warning(f"unable to watch '{path}': {e}")
+                        if not pending:
+                            first_at = now
+                        pending.add(path)
+                        last_at = now
+
+                # wait for things to quiet down, but don't hold changes back forever during long copies
+                if pending and (now - last_at >= self.debounce or now - first_at >= self.debounce * 10):
+                    self._process(pending)
+                    pending = set()
+        finally:
+            inotify.close()
+            os.close(self.__wake_r)
+            os.close(self.__wake_w)
+            self.__wake_r, self.__wake_w = None, None
+
+    def _poll_loop(self):
+        while not self.__stop.wait(self.interval):
+            self._scan()
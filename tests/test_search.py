@@ -0,0 +1,43 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "koulouri"))
+from search import SearchIndex
+
+def song(i: int, title: str, artist: str, album: str = "") -> dict:
+    return {"info": {"path": f"/music/{i}.flac", "title": title, "artist": artist, "album": album}}
+
+class SearchSessionTest(unittest.TestCase):
+    def setUp(self):
+        self.index = SearchIndex([
+            song(0, "Yesterday", "The Beatles", "Help!"),
+            song(1, "Hello", "Adele", "25"),
+            song(2, "Come Together", "The Beatles", "Abbey Road"),
+            song(3, "Bohemian Rhapsody", "Queen", "A Night at the Opera"),
+        ])
+
+    def type(self, query: str) -> list:
+        session = self.index.session()
+        results = []
+        for i in range(1, len(query)+1):
+            results = session.update(query[:i])
+        return results
+
+    def test_typing_matches_search(self):
+        for query in ["beatles", "bwatles", "bohemain", "come togther", "adele"]:
+            with self.subTest(query=query):
+                self.assertEqual(self.type(query), self.index.search(query))
+
+    def test_typo_early_in_query(self):
+        titles = [_["info"]["title"] for _ in self.type("bwatles")]
+        self.assertIn("Yesterday", titles)
+
+    def test_backspace(self):
+        session = self.index.session()
+        for query in ["be", "bea", "beat", "bea", "bel"]:
+            results = session.update(query)
+        self.assertEqual(results, self.index.search("bel"))
+
+if __name__ == "__main__":
+    unittest.main()